@@ -0,0 +1,71 @@
+"""
+    Micro-benchmark of decoding asyncpg records to pydantic models:
+    current per-row path (Model(**record)) against RecordDecoder modes.
+
+    python -m benchmarks.decoding
+"""
+from datetime import datetime
+import timeit
+
+from pydantic import BaseModel
+
+# asyncpg helper to build records without database
+from asyncpg.protocol.protocol import _create_record
+
+from fastapiplugins.controllers import decode_records
+
+
+class Item(BaseModel):
+    id: int
+    owner_id: int
+    title: str
+    body: str
+    price: float
+    created_at: datetime
+    deleted: bool
+
+
+COLUMNS = {
+    name: i for i, name in enumerate(Item.model_fields)
+}
+
+ROWS = 10_000
+REPEAT = 5
+
+
+def make_records(count: int) -> list:
+    return [
+        _create_record(
+            COLUMNS,
+            (i, i % 100, f'title {i}', 'body' * 10, i / 3, datetime.now(), False),
+        )
+        for i in range(count)
+    ]
+
+
+def per_row(records):
+    return [Item(**record) for record in records]
+
+
+def main():
+    records = make_records(ROWS)
+    cases = {
+        'Model(**record)': lambda: per_row(records),
+        'decoder validate': lambda: decode_records(records, Item),
+        'decoder construct': lambda: decode_records(records, Item, 'construct'),
+        'decoder dict': lambda: decode_records(records, Item, 'dict'),
+        'decoder tuple': lambda: decode_records(records, Item, 'tuple'),
+    }
+    baseline = None
+    print(f'{ROWS} rows, best of {REPEAT}')
+    for title, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=REPEAT))
+        baseline = baseline or best
+        print(
+            f'{title:<20} {best * 1000:8.2f} ms '
+            f'{best / ROWS * 1e6:6.2f} us/row  x{baseline / best:.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+    Import time of package entry points, each measured in fresh
+    interpreter with -X importtime, and heavy optional dependencies
+    loaded by the import.
+
+    python -m benchmarks.import_time
+"""
+import subprocess
+import sys
+
+
+TARGETS = (
+    'import fastapiplugins',
+    'from fastapiplugins import TokenManager',
+    'from fastapiplugins import prepare_exceptions',
+    'from fastapiplugins import select_q',
+    'from fastapiplugins import DatabaseManager',
+    'from fastapiplugins.controllers import exceptions',
+    'from fastapiplugins import RabbitManager',
+)
+
+HEAVY_MODULES = ('asyncpg', 'aio_pika', 'aiormq')
+
+REPEAT = 5
+
+
+def measure(statement: str) -> tuple[float, list]:
+    """
+        returns total import time in ms and heavy modules loaded
+    """
+    check = (
+        f'{statement}\n'
+        'import sys\n'
+        f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', check],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us = line.split(':', 1)[1].split('|')[0]
+        total += int(self_us)
+    loaded = [module for module in result.stdout.strip().split(',') if module]
+    return total / 1000, loaded
+
+
+def main():
+    print(f'best of {REPEAT}, fresh interpreter for each run')
+    for statement in TARGETS:
+        try:
+            runs = [measure(statement) for _ in range(REPEAT)]
+        except subprocess.CalledProcessError as e:
+            print(f'{statement:<50} failed: {e.stderr.strip().splitlines()[-1]}')
+            continue
+        best = min(elapsed for elapsed, _ in runs)
+        loaded = ', '.join(runs[0][1]) or '-'
+        print(f'{statement:<50} {best:8.1f} ms  loads: {loaded}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+    Throughput of RabbitManager publish and consume on in-memory
+    loopback transport, for serializer, prefetch and concurrency
+    settings: messages per second, end-to-end latency percentiles
+    and peak traced memory. Memory is traced in separate run,
+    tracemalloc slows allocations down several times.
+
+    Latency is measured from the moment a chunk of messages is
+    built for publish_many to the moment handler gets a message,
+    so it includes time spent waiting in queue.
+
+    python -m benchmarks.rabbit_throughput
+"""
+import asyncio
+import itertools
+import time
+import tracemalloc
+
+from fastapiplugins.rabbit import RabbitManager
+from fastapiplugins.serializers import (
+    JsonSerializer,
+    MsgpackSerializer,
+    msgpack,
+)
+
+
+MESSAGES = 10_000
+CHUNK = 500
+# simulated async io of handler, seconds
+HANDLER_DELAY = 0
+
+SERIALIZERS = {'json': JsonSerializer()}
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = MsgpackSerializer()
+
+PREFETCH = (1, 32, 256)
+CONCURRENCY = (1, 32, 256)
+
+PAYLOAD = {
+    'id': 1,
+    'title': 'benchmark message',
+    'tags': ['a', 'b', 'c'],
+    'price': 10.5,
+}
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_case(
+    number: int,
+    serializer_name: str,
+    prefetch: int,
+    concurrency: int,
+    trace_memory: bool = False,
+) -> dict:
+    serializer = SERIALIZERS[serializer_name]
+    latencies = []
+    done = asyncio.Event()
+
+    RabbitManager.Config.SUBSCRIBERS = dict()
+    RabbitManager.enable_metrics()
+
+    @RabbitManager.subscribe(
+        'bench',
+        'message',
+        prefetch_count=prefetch,
+        max_concurrency=concurrency,
+        serializer=serializer,
+    )
+    async def handler(payload):
+        latencies.append(time.perf_counter() - payload['sent'])
+        if HANDLER_DELAY:
+            await asyncio.sleep(HANDLER_DELAY)
+        if len(latencies) == MESSAGES:
+            done.set()
+
+    # own broker for every case
+    await RabbitManager.start(
+        f'bench-{number}', 0, 'guest', 'guest', transport='loopback',
+    )
+    await RabbitManager.start_consuming()
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(0, MESSAGES, CHUNK):
+        sent = time.perf_counter()
+        await RabbitManager.publish_many(
+            'bench',
+            'message',
+            [dict(PAYLOAD, sent=sent) for _ in range(CHUNK)],
+            serializer=serializer,
+        )
+    published = time.perf_counter() - started
+    await done.wait()
+    consumed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    await RabbitManager.stop()
+    latencies.sort()
+    return {
+        'publish': MESSAGES / published,
+        'consume': MESSAGES / consumed,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'peak': peak,
+    }
+
+
+async def main():
+    print(
+        f'{MESSAGES} messages, chunks of {CHUNK}, '
+        f'handler delay {HANDLER_DELAY}s'
+    )
+    print(
+        f'{"serializer":<10} {"prefetch":>8} {"concur":>6} '
+        f'{"publish/s":>10} {"consume/s":>10} '
+        f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"peak MB":>8}'
+    )
+    cases = itertools.product(SERIALIZERS, PREFETCH, CONCURRENCY)
+    for number, (serializer_name, prefetch, concurrency) in enumerate(cases):
+        result = await run_case(number, serializer_name, prefetch, concurrency)
+        result['peak'] = (await run_case(
+            number,
+            serializer_name,
+            prefetch,
+            concurrency,
+            trace_memory=True,
+        ))['peak']
+        print(
+            f'{serializer_name:<10} {prefetch:>8} {concurrency:>6} '
+            f'{result["publish"]:>10.0f} {result["consume"]:>10.0f} '
+            f'{result["p50"] * 1000:>8.2f} {result["p95"] * 1000:>8.2f} '
+            f'{result["p99"] * 1000:>8.2f} {result["peak"] / 2 ** 20:>8.1f}'
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+    Plugins for fastapi: database, queues, jwt tokens, exceptions.
+
+    Names below are imported lazily on first access, so services
+    using only TokenManager or prepare_exceptions do not import
+    asyncpg or aio_pika:
+
+        from fastapiplugins import TokenManager, prepare_exceptions
+"""
+from typing import Any, List
+
+import importlib
+from importlib.util import find_spec
+
+
+# optional dependencies of setup.py extras
+EXTRAS = {
+    'async': ('aio_pika', 'aiohttp', 'asyncpg'),
+    'sync': ('pika', 'requests', 'psycopg2'),
+}
+
+# name: (module, extra needed by module)
+LAZY_NAMES = {
+    'DatabaseManager': ('controllers', 'async'),
+    'insert_q': ('controllers', None),
+    'insert_many': ('controllers', None),
+    'update_q': ('controllers', None),
+    'upsert_q': ('controllers', None),
+    'upsert_many_q': ('controllers', None),
+    'delete_q': ('controllers', None),
+    'select_q': ('controllers', None),
+    'select_q_detailed': ('controllers', None),
+    'count_q': ('controllers', None),
+    'exists_q': ('controllers', None),
+    'next_cursor': ('controllers', None),
+    'decode_records': ('controllers', None),
+    'NoDataException': ('controllers', None),
+    'RabbitManager': ('rabbit', 'async'),
+    'RpcError': ('rabbit', 'async'),
+    'TokenManager': ('token', None),
+    'BadJwtException': ('token', None),
+    'ExceptionMessage': ('exceptions', None),
+    'HandlableException': ('exceptions', None),
+    'get_exception_id': ('exceptions', None),
+    'prepare_exceptions': ('exceptions', None),
+}
+
+__all__ = list(LAZY_NAMES)
+
+
+def has_extra(extra: str) -> bool:
+    """
+        True if all packages of setup.py extra are installed
+    """
+    return all(find_spec(package) for package in EXTRAS[extra])
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module_name, extra = LAZY_NAMES[name]
+    except KeyError:
+        raise AttributeError(
+            f'module {__name__!r} has no attribute {name!r}'
+        ) from None
+    try:
+        module = importlib.import_module(f'{__name__}.{module_name}')
+    except ImportError as e:
+        if extra and not has_extra(extra):
+            raise ImportError(
+                f'{name} needs "{extra}" extra, install it with '
+                f'pip install "fastapiplugins[{extra}]"'
+            ) from e
+        raise
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(LAZY_NAMES))
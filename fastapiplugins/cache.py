@@ -0,0 +1,184 @@
+from typing import Any, Callable, Hashable
+from collections import OrderedDict, defaultdict
+
+import time
+
+
+class QueryCache:
+    """
+        LRU cache for compiled sql templates.
+
+        Key is the shape of a query (kind of query, datatable,
+        field names, None-mask of conditions, ordering), value is
+        sql text. Argument values are never part of the key.
+
+        Key must start with (kind, datatable): cache remembers
+        them for every cached sql text in QueryCache.tables,
+        so result cache can find table of query. Entries of
+        tables are evicted together with their templates, with
+        maxsize 0 nothing is remembered and result cache can not
+        find tables of queries.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+    ):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.tables = dict()
+        # sql text: number of keys with this text
+        self._refs = defaultdict(int)
+        self._data = OrderedDict()
+
+    def get_or_build(
+        self,
+        key: Hashable,
+        build: Callable[[], str],
+    ) -> str:
+        """
+            return cached sql for key, or build it, cache it and
+            evict least recently used template if cache is full
+        """
+        try:
+            query = self._data[key]
+        except KeyError:
+            self.misses += 1
+            query = build()
+            if self.maxsize > 0:
+                self._data[key] = query
+                self.tables[query] = (key[0], key[1])
+                self._refs[query] += 1
+                if len(self._data) > self.maxsize:
+                    _, evicted = self._data.popitem(last=False)
+                    self._refs[evicted] -= 1
+                    if not self._refs[evicted]:
+                        del self._refs[evicted]
+                        del self.tables[evicted]
+            return query
+        self.hits += 1
+        self._data.move_to_end(key)
+        return query
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.tables.clear()
+        self._refs.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+MISSING = object()
+
+
+class ResultCache:
+    """
+        TTL and size bounded LRU cache of query results.
+
+        Key is (sql text, args), every entry remembers its table,
+        so all results of table can be dropped with invalidate().
+
+        Every invalidate() bumps generation of table. Reader takes
+        generation() before query and passes it to set(), so result
+        read before (or during) concurrent write is not cached.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._data = OrderedDict()
+        self._tables = defaultdict(set)
+        self._generations = defaultdict(int)
+
+    def get(self, key: Hashable) -> Any:
+        """
+            return cached value or MISSING
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires, table, value = entry
+        if expires <= time.monotonic():
+            self._pop(key)
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def generation(self, table: str) -> int:
+        return self._generations[table]
+
+    def set(
+        self,
+        key: Hashable,
+        table: str,
+        value: Any,
+        generation: int = None,
+    ) -> None:
+        """
+            cache value, unless table was invalidated
+            since generation was taken
+        """
+        if self.maxsize <= 0:
+            return
+        if generation is not None and generation != self._generations[table]:
+            return
+        if key in self._data:
+            self._pop(key)
+        self._data[key] = (time.monotonic() + self.ttl, table, value)
+        self._tables[table].add(key)
+        while len(self._data) > self.maxsize:
+            self._pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def invalidate(self, table: str) -> None:
+        """
+            drop all cached results of table
+        """
+        self._generations[table] += 1
+        keys = self._tables.pop(table, ())
+        for key in keys:
+            self._data.pop(key, None)
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._tables.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def _pop(self, key: Hashable) -> None:
+        _, table, _ = self._data.pop(key)
+        keys = self._tables.get(table)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tables[table]
@@ -1,14 +1,44 @@
-from typing import Callable, Any, Tuple, List
+from __future__ import annotations
+
+from typing import (
+    TYPE_CHECKING,
+    Awaitable,
+    Callable,
+    Any,
+    Tuple,
+    List,
+    Iterable,
+    AsyncIterable,
+    AsyncIterator,
+)
 
 from pydantic import BaseModel
 
 # from fastapi import HTTPException
 
-import asyncpg
-from asyncpg.pool import Pool
+import asyncio
+import base64
+import itertools
+import json
+import time
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from uuid import UUID
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache, partial
+
+import ujson
+
+if TYPE_CHECKING:
+    from asyncpg import Connection, Record
+    from asyncpg.pool import Pool
+    from asyncpg.transaction import Transaction
 
 # from fastapiplugins.utils import raise_exception
 from fastapiplugins.base import AbstractPlugin
+from fastapiplugins.cache import QueryCache, ResultCache, MISSING
+from fastapiplugins.metrics import DEFAULT_BUCKETS, Metrics
 from fastapiplugins.exceptions import (
     get_exception_id,
     ExceptionMessage,
@@ -21,13 +51,308 @@ import logging
 ORIGIN = 'PLUGINSCONTROLLERS'
 
 
+query_cache = QueryCache()
+
+@lru_cache(maxsize=None)
+def connection_errors() -> tuple:
+    """
+        errors meaning that database is unreachable.
+        asyncpg is imported lazily, so query builders
+        can be used without it
+    """
+    import asyncpg
+    return (
+        OSError,
+        asyncio.TimeoutError,
+        asyncpg.PostgresError,
+        asyncpg.InterfaceError,
+    )
+
+
+@lru_cache
+def has_get_statement() -> bool:
+    """
+        private Connection._get_statement(query, timeout) puts
+        statement to statement cache (asyncpg 0.32). Signature is
+        checked, on other versions statements are not prepared
+        in advance (public prepare() bypasses statement cache)
+    """
+    import inspect
+    from asyncpg.connection import Connection
+    method = getattr(Connection, '_get_statement', None)
+    if method is None:
+        return False
+    parameters = list(inspect.signature(method).parameters)
+    return parameters[1:3] == ['query', 'timeout']
+
+
+READ_QUERIES = {'select', 'select_detailed', 'count', 'exists'}
+WRITE_QUERIES = {'insert', 'update', 'delete', 'upsert'}
+
+# postgres limit of bind parameters in one query
+MAX_QUERY_ARGS = 32767
+
+
+primary_pinned: ContextVar[bool] = ContextVar('primary_pinned', default=False)
+
+
+class ConnectionProxy:
+    """
+        Wraps connection given by DatabaseManager.acqure_connection.
+
+        Reads built by select builders are served from result cache.
+        Writes built by insert/update/delete builders (and COPY)
+        drop cached results of their table. Other sql passes as is,
+        reads in transaction are never cached. Tables written in
+        transaction are invalidated again when it commits, so
+        results read before commit do not outlive it.
+
+        With metrics, latency of every query is observed per sql
+        template of builders (other sql is observed as 'other',
+        so labels stay bounded) and queries slower than
+        slow_query_threshold are logged.
+
+        With pin_writes, query that may write (insert/update/delete
+        builders, COPY and any sql not built by select builders)
+        pins current context to primary (see
+        DatabaseManager.pin_primary).
+    """
+
+    def __init__(
+        self,
+        conn: Connection,
+        result_cache: ResultCache = None,
+        metrics: Metrics = None,
+        slow_query_threshold: float = None,
+        pin_writes: bool = False,
+    ):
+        self._conn = conn
+        self._result_cache = result_cache
+        self._metrics = metrics
+        self._slow_query_threshold = slow_query_threshold
+        self._pin_writes = pin_writes
+        # tables written in current transaction
+        self._written = set()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def transaction(self, **kwargs) -> ProxyTransaction:
+        return ProxyTransaction(self, self._conn.transaction(**kwargs))
+
+    async def fetch(self, query: str, *args, **kwargs) -> List[Record]:
+        result = await self._call('fetch', query, args, kwargs)
+        return list(result)
+
+    async def fetchrow(self, query: str, *args, **kwargs) -> Record:
+        return await self._call('fetchrow', query, args, kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        return await self._call('fetchval', query, args, kwargs)
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        return await self._call('execute', query, args, kwargs)
+
+    async def executemany(self, query: str, args, **kwargs) -> None:
+        result = await self._timed(
+            query,
+            self._conn.executemany(query, args, **kwargs),
+        )
+        self._invalidate(query)
+        return result
+
+    async def fetchmany(self, query: str, args, **kwargs) -> List[Record]:
+        result = await self._timed(
+            query,
+            self._conn.fetchmany(query, args, **kwargs),
+        )
+        self._invalidate(query)
+        return result
+
+    async def copy_records_to_table(
+        self,
+        table_name: str,
+        *,
+        schema_name: str = None,
+        **kwargs,
+    ) -> str:
+        table = f'{schema_name}.{table_name}' if schema_name else table_name
+        query = f'COPY {table}'
+        result = await self._timed(
+            query,
+            self._conn.copy_records_to_table(
+                table_name,
+                schema_name=schema_name,
+                **kwargs,
+            ),
+            label=query,
+        )
+        self._invalidate_table(table)
+        return result
+
+    async def _call(
+        self,
+        method: str,
+        query: str,
+        args: tuple,
+        kwargs: dict,
+    ) -> Any:
+        kind, table = query_cache.tables.get(query, (None, None))
+        if (
+            self._result_cache is None
+            or kind not in READ_QUERIES
+            or kwargs
+            or self._conn.is_in_transaction()
+        ):
+            result = await self._timed(
+                query,
+                getattr(self._conn, method)(query, *args, **kwargs),
+            )
+            self._invalidate(query)
+            return result
+        key = (method, query, args)
+        try:
+            hash(key)
+        except TypeError:
+            return await self._timed(
+                query,
+                getattr(self._conn, method)(query, *args),
+            )
+        result = self._result_cache.get(key)
+        if result is MISSING:
+            generation = self._result_cache.generation(table)
+            result = await self._timed(
+                query,
+                getattr(self._conn, method)(query, *args),
+            )
+            self._result_cache.set(key, table, result, generation)
+        return result
+
+    async def _timed(
+        self,
+        query: str,
+        coro: Awaitable,
+        label: str = None,
+    ) -> Any:
+        if self._metrics is None and self._slow_query_threshold is None:
+            return await coro
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            elapsed = time.perf_counter() - started
+            if self._metrics is not None:
+                if label is None:
+                    label = query if query in query_cache.tables else 'other'
+                self._metrics.observe('db_query_seconds', elapsed, query=label)
+            if (
+                self._slow_query_threshold is not None
+                and elapsed >= self._slow_query_threshold
+            ):
+                logging.warning(
+                    f'DatabaseManager slow query ({elapsed:.3f}s):\n{query}'
+                )
+
+    def _invalidate(self, query: str) -> None:
+        kind, table = query_cache.tables.get(query, (None, None))
+        if kind in WRITE_QUERIES:
+            self._invalidate_table(table)
+        elif kind is None:
+            # sql of unknown kind may write
+            self._pin()
+
+    def _invalidate_table(self, table: str) -> None:
+        self._pin()
+        if self._result_cache is None:
+            return
+        self._result_cache.invalidate(table)
+        if self._conn.is_in_transaction():
+            self._written.add(table)
+
+    def _pin(self) -> None:
+        if self._pin_writes:
+            primary_pinned.set(True)
+
+    def _committed(self) -> None:
+        """ invalidate tables written in transaction after commit """
+        if self._conn.is_in_transaction():
+            # savepoint of nested transaction
+            return
+        written, self._written = self._written, set()
+        for table in written:
+            self._result_cache.invalidate(table)
+
+    def _rolled_back(self) -> None:
+        if not self._conn.is_in_transaction():
+            self._written = set()
+
+
+class ProxyTransaction:
+    """
+        asyncpg transaction of ConnectionProxy, that lets proxy
+        invalidate written tables after commit
+    """
+
+    def __init__(self, proxy: ConnectionProxy, transaction: Transaction):
+        self._proxy = proxy
+        self._transaction = transaction
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._transaction, name)
+
+    async def start(self) -> None:
+        await self._transaction.start()
+
+    async def commit(self) -> None:
+        await self._transaction.commit()
+        self._proxy._committed()
+
+    async def rollback(self) -> None:
+        await self._transaction.rollback()
+        self._proxy._rolled_back()
+
+    async def __aenter__(self) -> ProxyTransaction:
+        await self._transaction.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self._transaction.__aexit__(exc_type, exc, tb)
+        if exc_type is None:
+            self._proxy._committed()
+        else:
+            self._proxy._rolled_back()
+
+
 class DatabaseManager(AbstractPlugin):
     class Config:
         POOL: Pool = None
+        REPLICA_POOLS: List[Pool] = list()
+        REPLICA_STRATEGY: str = 'round_robin'  # or 'least_busy'
+        REPLICA_RETRY_AFTER: float = 5.0  # seconds replica considered down
+        REPLICA_DOWN: dict = dict()
+        REPLICA_COUNTER: itertools.count = itertools.count()
+        READ_YOUR_WRITES: bool = True
+        RESULT_CACHE: ResultCache = None
+        LOADERS: dict = dict()
+        METRICS: Metrics = None  # see enable_metrics
+        SLOW_QUERY_THRESHOLD: float = None  # seconds
         PSQL_DATABASE: str = None
         PSQL_USER: str = None
         PSQL_PASSWORD: str = None
         PSQL_HOST: str = None
+        PSQL_REPLICA_HOSTS: str = None  # comma separated hosts
+        PSQL_MIN_SIZE: int = 10
+        PSQL_MAX_SIZE: int = 10
+        PSQL_MAX_QUERIES: int = 50000
+        PSQL_MAX_INACTIVE_CONNECTION_LIFETIME: float = 300.0
+        PSQL_STATEMENT_CACHE_SIZE: int = 100
+        JSON_CODECS: bool = True
+        JSON_DUMPS: Callable = ujson.dumps
+        JSON_LOADS: Callable = ujson.loads
+        CODECS: List[dict] = list()
+        INIT: Callable = None
+        STATEMENTS: dict = dict()  # sql text of statements to prepare
+        READY: bool = False
 
     @classmethod
     async def start(
@@ -36,69 +361,836 @@ class DatabaseManager(AbstractPlugin):
         user: str,
         password: str,
         host: str,
+        replica_hosts: List[str] | str = None,
+        min_size: int = 10,
+        max_size: int = 10,
+        max_queries: int = 50000,
+        max_inactive_connection_lifetime: float = 300.0,
+        statement_cache_size: int = 100,
+        init: Callable = None,
+        codecs: List[dict] = None,
     ) -> None:
-        cls.Config.POOL = await asyncpg.create_pool(
+        """
+            create primary pool and replica pools.
+            pool settings are the same for every pool and can be
+            loaded with loads_secrets() (PSQL_MIN_SIZE, ...)
+
+            init is coroutine function called with every new
+            connection, codecs are kwargs for
+            Connection.set_type_codec, registered on every new
+            connection (see init_connection)
+
+            Pools open min_size connections before start() returns,
+            each of them prepares registered statements
+            (see register_statement), so after start() Config.READY
+            is set and first requests do not pay for warm-up.
+        """
+        cls.Config.READY = False
+        if init is not None:
+            cls.Config.INIT = init
+        if codecs is not None:
+            cls.Config.CODECS = codecs
+        # values from environment come as strings
+        pool_kwargs = dict(
             database=database,
             user=user,
             password=password,
-            host=host
+            min_size=int(min_size),
+            max_size=int(max_size),
+            max_queries=int(max_queries),
+            max_inactive_connection_lifetime=float(
+                max_inactive_connection_lifetime
+            ),
+            statement_cache_size=int(statement_cache_size),
+            init=cls.init_connection,
+        )
+        import asyncpg
+
+        cls.Config.POOL = await asyncpg.create_pool(
+            host=host,
+            **pool_kwargs,
         )
         logging.info(
             f'DatabaseManager create postgres pool on:{cls.Config.POOL}',
         )
+        if isinstance(replica_hosts, str):
+            replica_hosts = [
+                replica_host.strip()
+                for replica_host in replica_hosts.split(',')
+                if replica_host.strip()
+            ]
+        cls.Config.REPLICA_POOLS = list()
+        cls.Config.REPLICA_DOWN = dict()
+        for replica_host in replica_hosts or []:
+            try:
+                pool = await asyncpg.create_pool(
+                    host=replica_host,
+                    **pool_kwargs,
+                )
+            except connection_errors() as e:
+                logging.warning(
+                    f'DatabaseManager can not connect to replica '
+                    f'{replica_host}: {e}'
+                )
+                continue
+            cls.Config.REPLICA_POOLS.append(pool)
+            logging.info(
+                f'DatabaseManager create replica pool on:{pool}',
+            )
+        cls.Config.READY = True
+        if cls.Config.STATEMENTS and not has_get_statement():
+            logging.warning(
+                'DatabaseManager can not prepare statements in advance '
+                'with this asyncpg version, they are prepared on first use'
+            )
+        logging.info(
+            f'DatabaseManager is ready, {len(cls.Config.STATEMENTS)} '
+            f'statements registered'
+        )
 
     @classmethod
-    def acqure_connection(cls):
+    async def init_connection(cls, conn: Connection) -> None:
+        """
+            Called by pools for every new connection.
+
+            Registers json and jsonb codecs with Config.JSON_DUMPS
+            and Config.JSON_LOADS (ujson), so json columns are decoded
+            to python objects. str values are sent as is, so
+            already serialized json still works. Codecs are binary,
+            as COPY (insert_many) needs binary encoder for every column.
+
+            Then registers Config.CODECS, for example:
+                dict(typename='numeric', encoder=str, decoder=float)
+                dict(typename='uuid', encoder=str, decoder=str)
+            (schema defaults to 'pg_catalog'), and calls Config.INIT.
+            Text format codecs (asyncpg default) can not be used by
+            COPY, so with them insert_many sends rows with executemany.
+
+            Registered statements are prepared last, as
+            set_type_codec (in INIT too) drops statement cache.
+        """
+        if cls.Config.JSON_CODECS:
+            dumps = cls.Config.JSON_DUMPS
+            loads = cls.Config.JSON_LOADS
+
+            def json_encoder(value: Any) -> bytes:
+                if not isinstance(value, (str, bytes)):
+                    value = dumps(value)
+                return value.encode() if isinstance(value, str) else value
+
+            def jsonb_encoder(value: Any) -> bytes:
+                # binary jsonb is version byte and json text
+                return b'\x01' + json_encoder(value)
+
+            def jsonb_decoder(data: bytes) -> Any:
+                return loads(data[1:])
+
+            await conn.set_type_codec(
+                'json',
+                encoder=json_encoder,
+                decoder=loads,
+                schema='pg_catalog',
+                format='binary',
+            )
+            await conn.set_type_codec(
+                'jsonb',
+                encoder=jsonb_encoder,
+                decoder=jsonb_decoder,
+                schema='pg_catalog',
+                format='binary',
+            )
+        for codec in cls.Config.CODECS:
+            await conn.set_type_codec(**{'schema': 'pg_catalog', **codec})
+        if cls.Config.INIT is not None:
+            await cls.Config.INIT(conn)
+        if has_get_statement():
+            for query in cls.Config.STATEMENTS:
+                await cls.prepare_statement(conn, query)
+
+    @classmethod
+    def copy_supported(cls) -> bool:
+        """ COPY needs binary codecs, see init_connection """
+        return all(
+            codec.get('format', 'text') != 'text'
+            for codec in cls.Config.CODECS
+        )
+
+    @staticmethod
+    async def prepare_statement(conn: Connection, query: str) -> None:
+        """
+            put statement to connection statement cache, so
+            conn.fetch(query, ...) does not prepare it again.
+            Needs private asyncpg api, see has_get_statement
+        """
+        import asyncpg
+        try:
+            # public prepare() bypasses statement cache
+            await conn._get_statement(query, None)
+        except asyncpg.PostgresError as e:
+            # bad statement must not break pool, lost
+            # connection is raised to pool as is
+            logging.warning(
+                f'DatabaseManager can not prepare statement: {e}\n{query}'
+            )
+
+    @classmethod
+    def register_statement(cls, query: str, *args) -> str:
+        """
+            prepare query on every new connection. Accepts result of
+            query builders, arguments are ignored:
+                DatabaseManager.register_statement(*select_q('t', id=0))
+            Should be called before start().
+        """
+        cls.Config.STATEMENTS[query] = None
+        return query
+
+    @classmethod
+    def register_model(
+        cls,
+        datatable: str,
+        model: BaseModel,
+        lookups: List[str] = (),
+    ) -> None:
+        """
+            register templates, that query builders produce for
+            model: insert_q, select_q_detailed without conditions
+            and select_q/select_q_detailed by every lookup field
+        """
+        fields = list(model.model_fields)
+        cls.register_statement(
+            query_cache.get_or_build(
+                ('insert', datatable, tuple(fields)),
+                lambda: render_insert(datatable, fields),
+            )
+        )
+        cls.register_statement(*select_q_detailed(datatable, model))
+        for field in lookups:
+            cls.register_statement(*select_q(datatable, **{field: 0}))
+            cls.register_statement(
+                *select_q_detailed(datatable, model, **{field: 0})
+            )
+
+    @classmethod
+    def ready(cls) -> bool:
+        """
+            True after start() opened and warmed up connections,
+            use it in readiness probes
+        """
+        return cls.Config.READY
+
+    @classmethod
+    async def stop(cls) -> None:
+        cls.Config.READY = False
+        for pool in cls.Config.REPLICA_POOLS:
+            await pool.close()
+        cls.Config.REPLICA_POOLS = list()
+        if cls.Config.POOL:
+            await cls.Config.POOL.close()
+
+    @classmethod
+    def enable_result_cache(
+        cls,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+    ) -> ResultCache:
+        """
+            cache results of select builders queries, made with
+            connections of acqure_connection, for ttl seconds.
+            insert_q/update_q/delete_q queries, made with the same
+            manager, drop cached results of their table.
+        """
+        cls.Config.RESULT_CACHE = ResultCache(maxsize=maxsize, ttl=ttl)
+        return cls.Config.RESULT_CACHE
+
+    @classmethod
+    def enable_metrics(
+        cls,
+        callback: Callable[[str, str, float, dict], None] = None,
+        buckets: Tuple[float] = DEFAULT_BUCKETS,
+    ) -> Metrics:
+        """
+            observe query latency, connection acquire time and
+            pool usage (see Metrics). Connections of acqure_connection
+            are wrapped with ConnectionProxy while metrics are on.
+        """
+        cls.Config.METRICS = Metrics(callback=callback, buckets=buckets)
+        return cls.Config.METRICS
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return {
+            'queries': query_cache.stats(),
+            'results': (
+                cls.Config.RESULT_CACHE.stats()
+                if cls.Config.RESULT_CACHE else None
+            ),
+        }
+
+    @classmethod
+    def observe_pool(cls, pool: Pool, role: str) -> None:
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        cls.Config.METRICS.set('db_connections_in_use', size - idle, pool=role)
+        cls.Config.METRICS.set('db_connections_idle', idle, pool=role)
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        """
+            size, connections in use and idle connections of pools
+        """
+        pools = [('primary', cls.Config.POOL)] + [
+            (f'replica_{i}', pool)
+            for i, pool in enumerate(cls.Config.REPLICA_POOLS)
+        ]
+        return {
+            name: {
+                'size': pool.get_size(),
+                'min_size': pool.get_min_size(),
+                'max_size': pool.get_max_size(),
+                'in_use': pool.get_size() - pool.get_idle_size(),
+                'idle': pool.get_idle_size(),
+            }
+            for name, pool in pools
+            if pool is not None
+        }
+
+    @classmethod
+    def pin_primary(cls, pinned: bool = True) -> None:
+        """
+            route all readonly connections of current context
+            (request) to primary pool.
+
+            Pin is context variable: FastAPI handles every request
+            in its own context, so pin ends with request. Tasks
+            created from pinned context inherit pin, long-lived
+            tasks (consumers started after startup writes) should
+            call pin_primary(False).
+        """
+        primary_pinned.set(pinned)
+
+    @classmethod
+    def replica_pools(cls) -> List[Pool]:
+        """
+            replica pools, that are not marked as down,
+            in order they should be tried
+        """
+        now = time.monotonic()
+        replicas = [
+            pool for pool in cls.Config.REPLICA_POOLS
+            if cls.Config.REPLICA_DOWN.get(pool, 0) <= now
+        ]
+        if not replicas:
+            return replicas
+        if cls.Config.REPLICA_STRATEGY == 'least_busy':
+            replicas.sort(
+                key=lambda pool: pool.get_size() - pool.get_idle_size()
+            )
+        else:
+            shift = next(cls.Config.REPLICA_COUNTER) % len(replicas)
+            replicas = replicas[shift:] + replicas[:shift]
+        return replicas
+
+    @classmethod
+    @asynccontextmanager
+    async def acquire(
+        cls,
+        readonly: bool = False,
+    ) -> AsyncIterator[Connection]:
+        """
+            Acquire connection from primary pool or, for readonly
+            connections, from one of replica pools. Falls back
+            to primary if no replica is available, or if context
+            is pinned to primary.
+
+            Connection is given as is and writes made with it do not
+            pin context, call pin_primary() after them or use
+            connection(), that pins context on writes.
+        """
+        pool = cls.Config.POOL
+        role = 'primary'
+        conn = None
+        started = time.perf_counter()
+        if readonly and not primary_pinned.get():
+            for replica in cls.replica_pools():
+                try:
+                    conn = await replica.acquire()
+                except connection_errors() as e:
+                    logging.warning(
+                        f'DatabaseManager replica {replica} is down: {e}'
+                    )
+                    cls.Config.REPLICA_DOWN[replica] = (
+                        time.monotonic() + cls.Config.REPLICA_RETRY_AFTER
+                    )
+                    continue
+                pool = replica
+                role = 'replica'
+                break
+        if conn is None:
+            conn = await pool.acquire()
+        metrics = cls.Config.METRICS
+        if metrics is not None:
+            metrics.observe(
+                'db_acquire_seconds',
+                time.perf_counter() - started,
+                pool=role,
+            )
+            cls.observe_pool(pool, role)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    @classmethod
+    def acqure_connection(cls, readonly: bool = False):
         def decorator(func: Callable):
             async def wrapper(*args, **kwargs):
                 if kwargs.get('conn', None):
                     return await func(*args, **kwargs)
-                async with cls.Config.POOL.acquire() as conn:
+                async with cls.connection(readonly) as conn:
                     result = await func(*args, conn=conn, **kwargs)
                 return result
             return wrapper
         return decorator
 
+    @classmethod
+    @asynccontextmanager
+    async def connection(
+        cls,
+        readonly: bool = False,
+    ) -> AsyncIterator[Connection | ConnectionProxy]:
+        """
+            same as acquire(), but connection is wrapped in
+            ConnectionProxy, if result cache or metrics enabled.
+            With replicas, non readonly connection is wrapped too and
+            its first write pins current context to primary
+            (see Config.READ_YOUR_WRITES), so reads made after write
+            in the same request see written data.
+        """
+        pin_writes = (
+            not readonly
+            and cls.Config.READ_YOUR_WRITES
+            and bool(cls.Config.REPLICA_POOLS)
+        )
+        async with cls.acquire(readonly) as conn:
+            if (
+                cls.Config.RESULT_CACHE is not None
+                or cls.Config.METRICS is not None
+                or cls.Config.SLOW_QUERY_THRESHOLD is not None
+                or pin_writes
+            ):
+                conn = ConnectionProxy(
+                    conn,
+                    cls.Config.RESULT_CACHE,
+                    cls.Config.METRICS,
+                    cls.Config.SLOW_QUERY_THRESHOLD,
+                    pin_writes,
+                )
+            yield conn
+
+    @classmethod
+    async def load(
+        cls,
+        datatable: str,
+        field: str,
+        key: Any,
+        model: BaseModel = None,
+    ) -> List[Record | BaseModel]:
+        """
+            Rows of datatable where field = key.
+
+            Concurrent loads of the same (datatable, field), issued
+            in the same event loop tick, are coalesced into one
+            'field = ANY($1)' query (see BatchLoader).
+        """
+        loader = cls.Config.LOADERS.get((datatable, field, model))
+        if loader is None:
+            loader = BatchLoader(cls, datatable, field, model)
+            cls.Config.LOADERS[(datatable, field, model)] = loader
+        return await loader.load(key)
+
+    @classmethod
+    async def stream(
+        cls,
+        query: str,
+        *args,
+        prefetch: int = 100,
+        model: BaseModel = None,
+        mode: str = 'validate',
+        conn: Connection = None,
+    ) -> AsyncIterator[Record | BaseModel]:
+        """
+            Async generator over query results, fetched with
+            server-side cursor by batches of prefetch rows.
+            Rows are decoded to model if model provided
+            (see RecordDecoder for modes).
+
+            async for row in DatabaseManager.stream(*select_q('table')):
+                ...
+        """
+        if conn is None:
+            async with cls.acquire(readonly=True) as conn:
+                async for row in cls.stream(
+                    query,
+                    *args,
+                    prefetch=prefetch,
+                    model=model,
+                    mode=mode,
+                    conn=conn,
+                ):
+                    yield row
+            return
+        decoder = None
+        async with conn.transaction():
+            async for record in conn.cursor(query, *args, prefetch=prefetch):
+                if model is None:
+                    yield record
+                    continue
+                if decoder is None:
+                    decoder = get_decoder(model, tuple(record.keys()), mode)
+                yield decoder.decode(record)
+
+
+class BatchLoader:
+    """
+        DataLoader-like batcher of single key lookups.
+
+        load() calls made in the same event loop tick are
+        collected and sent as one select query with list of
+        keys (field = ANY($1)), rows are grouped by field value
+        and given back to every caller. With model only columns
+        of model projection are read (see get_fields).
+
+        Rows are matched to keys by str(), as asyncpg accepts
+        keys of other type than it returns (str keys of uuid
+        column give UUID values). Calls from context pinned to
+        primary (see DatabaseManager.pin_primary) are batched
+        separately and read from primary.
+    """
+
+    def __init__(
+        self,
+        manager: DatabaseManager,
+        datatable: str,
+        field: str,
+        model: BaseModel = None,
+    ):
+        self.manager = manager
+        self.datatable = datatable
+        self.field = field
+        self.model = model
+        # pinned to primary: {key: futures of callers}
+        self.pending = dict()
+        # running fetch tasks
+        self.tasks = set()
+
+    async def load(self, key: Any) -> List[Record | BaseModel]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pinned = primary_pinned.get()
+        pending = self.pending.get(pinned)
+        if pending is None:
+            pending = self.pending[pinned] = dict()
+            loop.call_soon(self.dispatch, pinned)
+        pending.setdefault(key, []).append(future)
+        return await future
+
+    def dispatch(self, pinned: bool) -> None:
+        pending = self.pending.pop(pinned)
+        task = asyncio.ensure_future(self.fetch(pending, pinned))
+        self.tasks.add(task)
+        task.add_done_callback(partial(self.fetched, pending))
+
+    async def fetch(self, pending: dict, pinned: bool = False) -> dict:
+        """ {str(key): records or models} """
+        # task runs in context copy of first caller
+        self.manager.pin_primary(pinned)
+        conditions = {self.field: list(pending)}
+        key = self.field
+        if self.model is not None and self.field in self.model.model_fields:
+            query = select_q_detailed(self.datatable, self.model, **conditions)
+            key = record_key(self.model, self.field)
+        else:
+            query = select_q(self.datatable, **conditions)
+        async with self.manager.connection(readonly=True) as conn:
+            records = await conn.fetch(*query)
+        grouped = dict()
+        for record in records:
+            grouped.setdefault(str(record[key]), []).append(record)
+        if self.model is not None:
+            grouped = {
+                key: decode_records(group, self.model)
+                for key, group in grouped.items()
+            }
+        return grouped
+
+    def fetched(self, pending: dict, task: asyncio.Task) -> None:
+        """
+            give result of fetch to every caller, or its exception,
+            callers are cancelled if fetch was cancelled
+        """
+        self.tasks.discard(task)
+        for key, futures in pending.items():
+            for future in futures:
+                if future.done():
+                    continue
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(
+                        list(task.result().get(str(key), ()))
+                    )
+
 
 def insert_q(
     data: dict | BaseModel,
     datatable: str,
 ) -> Tuple[str, Any]:
     fields, values = unpack_data(data)
-    query = (
+    query = query_cache.get_or_build(
+        ('insert', datatable, tuple(fields)),
+        lambda: render_insert(datatable, fields),
+    )
+    return query, *values
+
+
+def render_insert(
+    datatable: str,
+    fields: List[str],
+) -> str:
+    return (
         f'INSERT INTO \n'
         f'\t{datatable} \n'
         f'\t({", ".join(fields)}) \n'
         f'VALUES \n'
-        f'\t({", ".join( [ f"${i+1}" for i in range(0, len(values)) ])}) \n'
+        f'\t({", ".join( [ f"${i+1}" for i in range(0, len(fields)) ])}) \n'
         f'RETURNING *\n'
     )
+
+
+@DatabaseManager.acqure_connection()
+async def insert_many(
+    data: Iterable[dict | BaseModel] | AsyncIterable[dict | BaseModel],
+    datatable: str,
+    columns: List[str] = None,
+    chunk_size: int = 1000,
+    returning: bool = False,
+    conn: Connection = None,
+) -> int | List[Record]:
+    """
+        bulk insert for iterable (or async iterable) of models
+
+        rows are sent by chunks of chunk_size. Without returning
+        chunks are streamed with COPY (copy_records_to_table) and
+        number of inserted rows is returned (with executemany if
+        text codecs are registered, COPY can not encode them).
+        With returning=True chunks are sent with fetchmany (pipelined
+        executemany, that keeps RETURNING rows) and inserted records
+        are returned.
+
+        column order is taken from first model, if columns not provided
+    """
+    schema_name, _, table_name = datatable.rpartition('.')
+    inserted = [] if returning else 0
+    copy = DatabaseManager.copy_supported()
+    async for chunk in iterate_chunks(data, chunk_size):
+        if columns is None:
+            columns, _ = unpack_data(chunk[0])
+        records = [record_values(row, columns) for row in chunk]
+        if returning or not copy:
+            query = query_cache.get_or_build(
+                ('insert', datatable, tuple(columns)),
+                lambda: render_insert(datatable, columns),
+            )
+        if returning:
+            inserted.extend(await conn.fetchmany(query, records))
+        elif not copy:
+            await conn.executemany(query, records)
+            inserted += len(records)
+        else:
+            await conn.copy_records_to_table(
+                table_name,
+                records=records,
+                columns=columns,
+                schema_name=schema_name or None,
+            )
+            inserted += len(records)
+    return inserted
+
+
+async def iterate_chunks(
+    data: Iterable | AsyncIterable,
+    chunk_size: int,
+) -> AsyncIterator[list]:
+    """
+        split iterable or async iterable to lists of chunk_size length
+    """
+    chunk = []
+    if hasattr(data, '__aiter__'):
+        async for row in data:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    else:
+        for row in data:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def record_values(
+    data: dict | BaseModel,
+    columns: List[str],
+) -> tuple:
+    if isinstance(data, BaseModel):
+        data = data.model_dump()
+    return tuple(data[column] for column in columns)
+
+
+def upsert_q(
+    data: dict | BaseModel,
+    datatable: str,
+    conflict_target: List[str],
+    update_fields: List[str] = None,
+) -> Tuple[str, Any]:
+    """
+        INSERT ... ON CONFLICT (conflict_target) DO UPDATE
+
+        update_fields are columns updated on conflict, by default all
+        inserted columns except conflict_target. Empty update_fields
+        gives DO NOTHING (and RETURNING gives only inserted rows).
+    """
+    return upsert_many_q([data], datatable, conflict_target, update_fields)
+
+
+def upsert_many_q(
+    data: List[dict | BaseModel],
+    datatable: str,
+    conflict_target: List[str],
+    update_fields: List[str] = None,
+) -> Tuple[str, Any]:
+    """
+        multi-row upsert_q for batch of models in one statement.
+        columns are taken from first model. batch must not contain
+        two rows with the same conflict_target values and must fit
+        in MAX_QUERY_ARGS parameters (see upsert_many for chunking)
+    """
+    fields, _ = unpack_data(data[0])
+    values = []
+    for row in data:
+        values.extend(record_values(row, fields))
+    if len(values) > MAX_QUERY_ARGS:
+        raise ValueError(
+            f'upsert of {len(data)} rows needs {len(values)} query '
+            f'arguments, max is {MAX_QUERY_ARGS}'
+        )
+    conflict_target = tuple(conflict_target)
+    if update_fields is None:
+        update_fields = [
+            field for field in fields if field not in conflict_target
+        ]
+    update_fields = tuple(update_fields)
+    query = query_cache.get_or_build(
+        (
+            'upsert',
+            datatable,
+            tuple(fields),
+            conflict_target,
+            update_fields,
+            len(data),
+        ),
+        lambda: render_upsert(
+            datatable,
+            fields,
+            conflict_target,
+            update_fields,
+            len(data),
+        ),
+    )
     return query, *values
 
 
-# def condition_constuct(
-#     field: str,
-#     i: int,
-#     value: Any,
-# ) -> str:
-#     if value is None:
-#         return f'{field} is ${i}'
-#     return f'{field} = ${i}'
+def render_upsert(
+    datatable: str,
+    fields: List[str],
+    conflict_target: Tuple[str],
+    update_fields: Tuple[str],
+    rows: int = 1,
+) -> str:
+    width = len(fields)
+    placeholders = ", \n\t".join(
+        f'({", ".join(f"${row * width + i + 1}" for i in range(width))})'
+        for row in range(rows)
+    )
+    if update_fields:
+        assignments = ", ".join(
+            f'{field} = EXCLUDED.{field}' for field in update_fields
+        )
+        action = f'DO UPDATE SET\n\t{assignments} \n'
+    else:
+        action = 'DO NOTHING \n'
+    return (
+        f'INSERT INTO \n'
+        f'\t{datatable} \n'
+        f'\t({", ".join(fields)}) \n'
+        f'VALUES \n'
+        f'\t{placeholders} \n'
+        f'ON CONFLICT ({", ".join(conflict_target)}) {action}'
+        f'RETURNING *\n'
+    )
+
+
+@DatabaseManager.acqure_connection()
+async def upsert_many(
+    data: Iterable[dict | BaseModel] | AsyncIterable[dict | BaseModel],
+    datatable: str,
+    conflict_target: List[str],
+    update_fields: List[str] = None,
+    chunk_size: int = 1000,
+    conn: Connection = None,
+) -> List[Record]:
+    """
+        upsert iterable (or async iterable) of models with one
+        upsert_many_q statement per chunk of chunk_size rows
+        (less, if chunk does not fit in MAX_QUERY_ARGS)
+    """
+    upserted = []
+    async for chunk in iterate_chunks(data, chunk_size):
+        fields, _ = unpack_data(chunk[0])
+        rows = max(1, MAX_QUERY_ARGS // len(fields))
+        for i in range(0, len(chunk), rows):
+            upserted.extend(
+                await conn.fetch(
+                    *upsert_many_q(
+                        chunk[i:i + rows],
+                        datatable,
+                        conflict_target,
+                        update_fields,
+                    )
+                )
+            )
+    return upserted
 
 
 def delete_q(
     datatable: str,
     **data: dict[Any],
 ) -> Tuple[str, Any]:
-    conditions, values = generate_condidion(
-        data,
-    )
-    query = (
-        f'DELETE FROM\n'
-        f'\t{datatable}\n'
-        f'WHERE\n'
-        f'\t({" AND ".join(conditions)})\n'
-        f'RETURNING *\n'
+    shape, values = condition_shape(data)
+    query = query_cache.get_or_build(
+        ('delete', datatable, shape),
+        lambda: (
+            f'DELETE FROM\n'
+            f'\t{datatable}\n'
+            f'WHERE\n'
+            f'\t({" AND ".join(render_condition(shape))})\n'
+            f'RETURNING *\n'
+        ),
     )
     return query, *values
 
@@ -108,43 +1200,47 @@ def update_q(
     datatable: str,
     **conditions: dict[Any],
 ) -> Tuple[str, Any]:
-    placeholder, values = generate_placeholder(data)
-    condition, condition_values = generate_condidion(
-        conditions,
-        len(values),
+    fields, values = unpack_data(data)
+    shape, condition_values = condition_shape(conditions)
+    query = query_cache.get_or_build(
+        ('update', datatable, tuple(fields), shape),
+        lambda: (
+            f'UPDATE\n'
+            f'\t{datatable}\n'
+            f'set\n\t{", ".join(render_placeholder(fields))}\n'
+            f'where\n\t{" AND ".join(render_condition(shape, len(values)))}\n'
+            f'returning *\n'
+        ),
     )
-    query = (
-        f'UPDATE\n'
-        f'\t{datatable}\n'
-        f'set\n\t{", ".join(placeholder)}\n'
-        f'where\n\t{" AND ".join(condition)}\n'
-        f'returning *\n')
     return query, *values, *condition_values
 
 
 def select_q(
     datatable: str,
     ordering: List[str] = None,
+    limit: int = None,
+    after: str = None,
     **data: dict[Any],
 ) -> Tuple[str, Any]:
-    conditions, values = generate_condidion(
-        data,
-    )
-    ordering_str = ""
-    if ordering:
-        ordering_str = f"ORDER BY\n\t{', '.join(ordering)}"
-    sorting_str = ""
-    if data:
-        sorting_str = (
-            f'WHERE\n'
-            f'\t{" and ".join(conditions)}'
-        )
-    query = (
-        f'SELECT *\n'
-        f'FROM\n'
-        f'\t{datatable}\n'
-        f'{sorting_str}\n'
-        f'{ordering_str}\n'
+    """
+        limit and after enable keyset pagination: after is cursor
+        returned by next_cursor() for previous page, rows are
+        filtered with '(a, b) > ($n, $m)' predicate on ordering
+        columns instead of OFFSET
+    """
+    shape, values = condition_shape(data)
+    ordering = tuple(ordering) if ordering else None
+    values.extend(keyset_values(ordering, limit, after))
+    query = query_cache.get_or_build(
+        ('select', datatable, shape, ordering, limit is not None, bool(after)),
+        lambda: render_select(
+            '*',
+            datatable,
+            shape,
+            ordering,
+            limit is not None,
+            bool(after),
+        ),
     )
     return query, *values
 
@@ -153,28 +1249,266 @@ def select_q_detailed(
     datatable: str,
     model: dict | BaseModel,
     ordering: List[str] = None,
+    limit: int = None,
+    after: str = None,
     **data: dict[Any],
 ) -> Tuple[str, Any]:
-    conditions, values = generate_condidion(data)
-    fields = get_fields(model)
+    # instances are not hashable, projection is the same for class
+    model = model if isinstance(model, type) else type(model)
+    shape, values = condition_shape(data)
+    ordering = tuple(ordering) if ordering else None
+    values.extend(keyset_values(ordering, limit, after))
+    query = query_cache.get_or_build(
+        (
+            'select_detailed',
+            datatable,
+            model,
+            shape,
+            ordering,
+            limit is not None,
+            bool(after),
+        ),
+        lambda: render_select(
+            ", ".join(get_fields(model)),
+            datatable,
+            shape,
+            ordering,
+            limit is not None,
+            bool(after),
+        ),
+    )
+    return query, *values
+
+
+def count_q(
+    datatable: str,
+    **data: dict[Any],
+) -> Tuple[str, Any]:
+    """
+        SELECT count(*) with select_q conditions
+    """
+    shape, values = condition_shape(data)
+    query = query_cache.get_or_build(
+        ('count', datatable, shape),
+        lambda: render_select('count(*)', datatable, shape),
+    )
+    return query, *values
+
+
+def exists_q(
+    datatable: str,
+    **data: dict[Any],
+) -> Tuple[str, Any]:
+    """
+        SELECT EXISTS (...) with select_q conditions,
+        stops at first matching row
+    """
+    shape, values = condition_shape(data)
+    query = query_cache.get_or_build(
+        ('exists', datatable, shape),
+        lambda: (
+            f'SELECT EXISTS (\n'
+            f'{render_select("1", datatable, shape)}'
+            f')\n'
+        ),
+    )
+    return query, *values
+
+
+@DatabaseManager.acqure_connection(readonly=True)
+async def estimated_count(
+    datatable: str,
+    conn: Connection = None,
+    **data: dict[Any],
+) -> int:
+    """
+        Rows count estimated by planner, without scanning table.
+
+        Without conditions reltuples of table from pg_class is used
+        (exact count_q if table was never analyzed), with conditions
+        row estimate of EXPLAIN for select_q. Fits for large tables,
+        where exact count is too costly on every request.
+    """
+    if not data:
+        estimate = await conn.fetchval(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = $1::regclass',
+            datatable,
+        )
+        if estimate is not None and estimate >= 0:
+            return estimate
+        return await conn.fetchval(*count_q(datatable))
+    query, *values = select_q(datatable, **data)
+    plan = await conn.fetchval(f'EXPLAIN (FORMAT JSON) {query}', *values)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def render_select(
+    columns: str,
+    datatable: str,
+    shape: tuple,
+    ordering: tuple = None,
+    limit: bool = False,
+    after: bool = False,
+) -> str:
     ordering_str = ""
     if ordering:
         ordering_str = f"ORDER BY\n\t{', '.join(ordering)}"
+    conditions = render_condition(shape)
+    i = count_placeholders(shape)
+    if after:
+        keyset_columns, operator = parse_ordering(ordering)
+        placeholders = ", ".join(
+            f'${i + n + 1}' for n in range(len(keyset_columns))
+        )
+        conditions.append(
+            f'({", ".join(keyset_columns)}) {operator} ({placeholders})'
+        )
+        i += len(keyset_columns)
     sorting_str = ""
-    if data:
+    if conditions:
         sorting_str = (
             f'WHERE\n'
             f'\t{" and ".join(conditions)}'
         )
-    query = (
-        f'SELECT\n'
-        f'\t{", ".join(fields)}\n'
+    limit_str = ""
+    if limit:
+        limit_str = f'LIMIT ${i + 1}\n'
+    if columns == '*':
+        columns_str = 'SELECT *\n'
+    else:
+        columns_str = f'SELECT\n\t{columns}\n'
+    return (
+        f'{columns_str}'
         f'FROM\n'
         f'\t{datatable}\n'
         f'{sorting_str}\n'
         f'{ordering_str}\n'
+        f'{limit_str}'
     )
-    return query, *values
+
+
+def parse_ordering(ordering: tuple) -> tuple[list, str]:
+    """
+        returns column names of ordering and keyset comparison
+        operator: '>' for ascending, '<' for descending ordering.
+        row comparison needs all columns sorted in one direction.
+    """
+    if not ordering:
+        raise BadCursorException('keyset pagination requires ordering')
+    columns = []
+    directions = set()
+    for item in ordering:
+        column, *direction = item.split()
+        columns.append(column)
+        directions.add(direction[0].lower() if direction else 'asc')
+    if len(directions) > 1:
+        raise BadCursorException(
+            'keyset pagination requires same direction for all ordering'
+        )
+    return columns, '<' if directions == {'desc'} else '>'
+
+
+def keyset_values(
+    ordering: tuple,
+    limit: int = None,
+    after: str = None,
+) -> list:
+    values = []
+    if after:
+        keyset_columns, _ = parse_ordering(ordering)
+        values = decode_cursor(after)
+        if len(values) != len(keyset_columns):
+            raise BadCursorException('cursor does not match ordering')
+    if limit is not None:
+        values.append(limit)
+    return values
+
+
+def next_cursor(
+    rows: List[Record | BaseModel],
+    ordering: List[str],
+    limit: int = None,
+) -> str | None:
+    """
+        cursor to fetch page after rows. returns None if
+        rows are the last page (less than limit rows)
+    """
+    if not rows or (limit is not None and len(rows) < limit):
+        return None
+    keyset_columns, _ = parse_ordering(ordering)
+    last = rows[-1]
+    if isinstance(last, BaseModel):
+        return encode_cursor(
+            [getattr(last, column) for column in keyset_columns]
+        )
+    return encode_cursor([last[column] for column in keyset_columns])
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(
+        json.dumps(values, default=cursor_default).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()),
+            object_hook=cursor_object_hook,
+        )
+    except (ValueError, TypeError, ArithmeticError) as e:
+        # Decimal raises InvalidOperation, an ArithmeticError
+        raise BadCursorException('cursor can not be decoded') from e
+    if not isinstance(values, list):
+        raise BadCursorException('cursor can not be decoded')
+    # values go to query as is, asyncpg fails on other types
+    for value in values:
+        if not isinstance(value, CURSOR_VALUE_TYPES):
+            raise BadCursorException('cursor can not be decoded')
+    return values
+
+
+CURSOR_TYPES = {
+    '$datetime': datetime.fromisoformat,
+    '$date': date.fromisoformat,
+    '$time': dt_time.fromisoformat,
+    '$uuid': UUID,
+    '$decimal': Decimal,
+}
+
+# scalar json values and types of CURSOR_TYPES
+CURSOR_VALUE_TYPES = (
+    type(None), bool, int, float, str,
+    datetime, date, dt_time, UUID, Decimal,
+)
+
+
+def cursor_default(value: Any) -> dict:
+    """
+        keep types of ordering values in cursor,
+        so they can be passed back to asyncpg as is
+    """
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, dt_time):
+        return {'$time': value.isoformat()}
+    if isinstance(value, UUID):
+        return {'$uuid': str(value)}
+    if isinstance(value, Decimal):
+        return {'$decimal': str(value)}
+    raise TypeError(f'{type(value)} can not be used in cursor')
+
+
+def cursor_object_hook(obj: dict) -> Any:
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key in CURSOR_TYPES:
+            return CURSOR_TYPES[key](value)
+    return obj
 
 
 def unpack_data(data: dict | BaseModel) -> tuple[list, list]:
@@ -190,43 +1524,90 @@ def unpack_data(data: dict | BaseModel) -> tuple[list, list]:
     return fields, values
 
 
-def generate_placeholder(
-    data: dict | BaseModel,
+def render_placeholder(
+    fields: List[str],
     i: int = 0,
-) -> tuple[list]:
+) -> List[str]:
     """
         returns pairs like 'field_name = $1'
-        and values
     """
-    fields, values = unpack_data(data)
     pair = []
     for field in fields:
         i += 1
         pair.append(f'{field} = ${i}')
-    return pair, values
+    return pair
 
 
-def generate_condidion(
+def generate_placeholder(
     data: dict | BaseModel,
     i: int = 0,
-    # pair_construct:
-    # Callable[[str, int, Any], str] = lambda field, i, value: f'{field} = ${i}'
 ) -> tuple[list]:
     """
         returns pairs like 'field_name = $1'
         and values
     """
     fields, values = unpack_data(data)
-    pair = []
-    for field, value in zip(fields, values.copy()):
+    return render_placeholder(fields, i), values
+
+
+def condition_shape(data: dict) -> tuple[tuple, list]:
+    """
+        returns hashable shape of conditions, pairs like
+        ('field_name', 'eq'), ('field_name', 'null') or
+        ('field_name', 'any') for list, tuple or set values,
+        and values for placeholders
+    """
+    shape = []
+    values = []
+    for field, value in data.items():
         if value is None:
+            shape.append((field, 'null'))
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            shape.append((field, 'any'))
+            values.append(list(value))
+        else:
+            shape.append((field, 'eq'))
+            values.append(value)
+    return tuple(shape), values
+
+
+def render_condition(
+    shape: tuple,
+    i: int = 0,
+) -> List[str]:
+    """
+        returns pairs like 'field_name = $1', 'field_name = ANY($1)'
+        or 'field_name is null' for condition shape
+    """
+    pair = []
+    for field, operator in shape:
+        if operator == 'null':
             pair.append(f'{field} is null')
-            values.remove(None)
+        elif operator == 'any':
+            i += 1
+            pair.append(f'{field} = ANY(${i})')
         else:
             i += 1
             pair.append(f'{field} = ${i}')
-            # pair.append(pair_construct(field, i, value))
-    return pair, values
+    return pair
+
+
+def count_placeholders(shape: tuple) -> int:
+    return sum(1 for _, operator in shape if operator != 'null')
+
+
+def generate_condidion(
+    data: dict | BaseModel,
+    i: int = 0,
+) -> tuple[list]:
+    """
+        returns pairs like 'field_name = $1'
+        and values
+    """
+    if isinstance(data, BaseModel):
+        data = data.model_dump()
+    shape, values = condition_shape(data)
+    return render_condition(shape, i), values
 
 
 def validate(func):
@@ -236,8 +1617,165 @@ def validate(func):
     return wrapper
 
 
-def get_fields(model):
-    return model.__fields__.keys()
+@lru_cache(maxsize=None)
+def get_fields(model: BaseModel) -> Tuple[str]:
+    """
+        Projection of model: columns select builders should read
+        to build model, computed once per model.
+
+        Columns are field names (as insert_q writes them).
+        Fields with alias are selected as 'name AS "alias"',
+        so records validate to model as is. Excluded fields
+        (Field(exclude=True)) with default never reach response and
+        are skipped, computed fields are not columns at all.
+        Nested models are read from their (json) column.
+    """
+    columns = []
+    for name, field in model.model_fields.items():
+        if field.exclude and not field.is_required():
+            continue
+        alias = record_key(model, name)
+        if alias != name:
+            columns.append(f'{name} AS "{alias}"')
+        else:
+            columns.append(name)
+    return tuple(columns)
+
+
+def record_key(model: BaseModel, name: str) -> str:
+    """
+        key of field in record selected with get_fields
+    """
+    field = model.model_fields[name]
+    if isinstance(field.validation_alias, str):
+        return field.validation_alias
+    return field.alias or name
+
+
+class RecordDecoder:
+    """
+        Precompiled decoder of records with known columns to model.
+
+        mode:
+            'validate' -- model.model_validate, same as Model(**record)
+            'construct' -- model.model_construct, skips validation,
+                use only for trusted database output
+            'dict' -- plain dicts of model fields
+            'tuple' -- plain tuples of model fields
+
+        Use get_decoder() to get cached decoder for
+        (model, columns, mode).
+    """
+
+    def __init__(
+        self,
+        model: BaseModel,
+        columns: Tuple[str],
+        mode: str = 'validate',
+    ):
+        if mode not in ('validate', 'construct', 'dict', 'tuple'):
+            raise ValueError(f'Unknown decoding mode: {mode}')
+        self.model = model
+        self.columns = columns
+        self.mode = mode
+        names = field_names_by_column(model)
+        # record positions that belong to model fields
+        self.positions = tuple(
+            i for i, column in enumerate(columns) if column in names
+        )
+        if mode == 'validate':
+            self.names = tuple(columns[i] for i in self.positions)
+        else:
+            self.names = tuple(names[columns[i]] for i in self.positions)
+        # model_construct fills defaults, private attributes and
+        # extra, and calls model_post_init, not needed if every
+        # field comes from record and model has none of them
+        self.complete = (
+            set(self.names) == set(model.model_fields)
+            and not model.__private_attributes__
+            and not model.__pydantic_post_init__
+            and model.model_config.get('extra') != 'allow'
+        )
+
+    def construct(self, row: dict) -> BaseModel:
+        """
+            same as model_construct(**row) for row with all model
+            fields, if model is complete (see __init__)
+        """
+        instance = self.model.__new__(self.model)
+        object.__setattr__(instance, '__dict__', row)
+        object.__setattr__(instance, '__pydantic_fields_set__', set(row))
+        object.__setattr__(instance, '__pydantic_extra__', None)
+        object.__setattr__(instance, '__pydantic_private__', None)
+        return instance
+
+    def decode(self, record: Record) -> BaseModel | dict | tuple:
+        return self.decode_many((record,))[0]
+
+    def decode_many(
+        self,
+        records: List[Record],
+    ) -> List[BaseModel | dict | tuple]:
+        names = self.names
+        positions = self.positions
+        if self.mode == 'tuple':
+            return [
+                tuple([record[i] for i in positions]) for record in records
+            ]
+        if len(positions) == len(self.columns):
+            rows = [dict(zip(names, record)) for record in records]
+        else:
+            rows = [
+                dict(zip(names, [record[i] for i in positions]))
+                for record in records
+            ]
+        if self.mode == 'dict':
+            return rows
+        if self.mode == 'construct' and self.complete:
+            return [self.construct(row) for row in rows]
+        if self.mode == 'construct':
+            construct = self.model.model_construct
+            return [construct(**row) for row in rows]
+        validate = self.model.model_validate
+        return [validate(row) for row in rows]
+
+
+@lru_cache(maxsize=256)
+def get_decoder(
+    model: BaseModel,
+    columns: Tuple[str],
+    mode: str = 'validate',
+) -> RecordDecoder:
+    return RecordDecoder(model, columns, mode)
+
+
+def decode_records(
+    records: List[Record],
+    model: BaseModel,
+    mode: str = 'validate',
+) -> List[BaseModel | dict | tuple]:
+    """
+        decode list of records (result of conn.fetch) to models
+        with cached decoder for model and columns of records
+    """
+    if not records:
+        return []
+    decoder = get_decoder(model, tuple(records[0].keys()), mode)
+    return decoder.decode_many(records)
+
+
+def field_names_by_column(model: BaseModel) -> dict:
+    """
+        map of column names (field names, aliases and record keys
+        of get_fields projection) to model field names
+    """
+    names = {}
+    for name, field in model.model_fields.items():
+        names[name] = name
+        if field.alias:
+            names[field.alias] = name
+        names[record_key(model, name)] = name
+    return names
 
 
 class NoDataException(Exception):
@@ -245,65 +1783,88 @@ class NoDataException(Exception):
         super().__init__(*args, **kwargs)
 
 
-exceptions = {
-    NoDataException:
-        ExceptionMessage(
-            id=get_exception_id(f"{ORIGIN}_GENERIC", 'noqueryresult'),
-            status=404,
-            title='controllers: No result from sql query'
-        ),
-    asyncpg.exceptions.UniqueViolationError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'uniqueviolationerror'),
-            status=422,
-            title="postgres: UniqueViolationError",
-        ),
-    asyncpg.exceptions.ForeignKeyViolationError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'foreignkeyviolationerror'),
-            status=422,
-            title="postgres: ForeignKeyViolationError",
-        ),
-    asyncpg.exceptions.NotNullViolationError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'notnullviolationerror'),
-            status=422,
-            title="postgres: NotNullViolationError",
-        ),
-    asyncpg.exceptions.CheckViolationError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'checkviolationerror'),
-            status=422,
-            title="postgres: CheckViolationError",
-        ),
-    asyncpg.exceptions.RestrictViolationError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'restrictviolationerror'),
-            status=422,
-            title="postgres: RestrictViolationError",
-        ),
-    asyncpg.exceptions.ExclusionViolationError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'exclusionviolationerror'),
-            status=422,
-            title="postgres: ExclusionViolationError",
-        ),
-    asyncpg.exceptions.InvalidForeignKeyError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'invalidforeignkeyerror'),
-            status=422,
-            title="postgres: InvalidForeignKeyError",
-        ),
-    asyncpg.exceptions.NameTooLongError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'nametoolongerror'),
-            status=422,
-            title="postgres: NameTooLongError",
-        ),
-    asyncpg.exceptions.DuplicateColumnError:
-        ExceptionMessage(
-            id=get_exception_id(ORIGIN, 'duplicatecolumnerroror'),
-            status=422,
-            title="postgres: DuplicateColumnErroror",
-        ),
-}
+class BadCursorException(ValueError):
+    pass
+
+
+def __getattr__(name: str) -> Any:
+    """
+        exceptions dict is built on first access,
+        so asyncpg is not imported with module
+    """
+    if name == 'exceptions':
+        globals()['exceptions'] = build_exceptions()
+        return globals()['exceptions']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def build_exceptions() -> dict:
+    import asyncpg
+    return {
+        NoDataException:
+            ExceptionMessage(
+                id=get_exception_id(f"{ORIGIN}_GENERIC", 'noqueryresult'),
+                status=404,
+                title='controllers: No result from sql query'
+            ),
+        BadCursorException:
+            ExceptionMessage(
+                id=get_exception_id(f"{ORIGIN}_GENERIC", 'badcursor'),
+                status=422,
+                title='controllers: Bad pagination cursor'
+            ),
+        asyncpg.exceptions.UniqueViolationError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'uniqueviolationerror'),
+                status=422,
+                title="postgres: UniqueViolationError",
+            ),
+        asyncpg.exceptions.ForeignKeyViolationError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'foreignkeyviolationerror'),
+                status=422,
+                title="postgres: ForeignKeyViolationError",
+            ),
+        asyncpg.exceptions.NotNullViolationError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'notnullviolationerror'),
+                status=422,
+                title="postgres: NotNullViolationError",
+            ),
+        asyncpg.exceptions.CheckViolationError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'checkviolationerror'),
+                status=422,
+                title="postgres: CheckViolationError",
+            ),
+        asyncpg.exceptions.RestrictViolationError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'restrictviolationerror'),
+                status=422,
+                title="postgres: RestrictViolationError",
+            ),
+        asyncpg.exceptions.ExclusionViolationError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'exclusionviolationerror'),
+                status=422,
+                title="postgres: ExclusionViolationError",
+            ),
+        asyncpg.exceptions.InvalidForeignKeyError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'invalidforeignkeyerror'),
+                status=422,
+                title="postgres: InvalidForeignKeyError",
+            ),
+        asyncpg.exceptions.NameTooLongError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'nametoolongerror'),
+                status=422,
+                title="postgres: NameTooLongError",
+            ),
+        asyncpg.exceptions.DuplicateColumnError:
+            ExceptionMessage(
+                id=get_exception_id(ORIGIN, 'duplicatecolumnerroror'),
+                status=422,
+                title="postgres: DuplicateColumnErroror",
+            ),
+    }
@@ -0,0 +1,507 @@
+"""
+    In-memory loopback broker for RabbitManager.
+
+    Implements the subset of aio_pika used by RabbitManager:
+    exchanges (direct, fanout, topic), queues, bindings, publish,
+    consume with prefetch, ack/reject and direct reply-to. Messages
+    never leave the process, so consumers can be benchmarked and
+    load-tested without RabbitMQ:
+
+        await RabbitManager.start(
+            'localhost', 5672, 'guest', 'guest', transport='loopback',
+        )
+
+    Not a broker emulator: no persistence, no message expiration,
+    publisher confirms resolve immediately.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import itertools
+import logging
+import re
+
+from aio_pika import ExchangeType, Message
+
+
+# pseudo-queue of RabbitMQ direct reply-to
+REPLY_TO = 'amq.rabbitmq.reply-to'
+
+EXCHANGE_TYPES = (ExchangeType.DIRECT, ExchangeType.FANOUT, ExchangeType.TOPIC)
+
+
+class Envelope:
+    """ published message with its routing state """
+    __slots__ = (
+        'message', 'exchange', 'routing_key', 'reply_to', 'redelivered',
+    )
+
+    def __init__(
+        self,
+        message: Message,
+        exchange: str,
+        routing_key: str,
+        reply_to: Optional[str],
+    ):
+        self.message = message
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.reply_to = reply_to
+        self.redelivered = False
+
+
+class LoopbackMessage:
+    """ delivered message, like aio_pika.IncomingMessage """
+
+    def __init__(
+        self,
+        envelope: Envelope,
+        channel: 'LoopbackChannel',
+        delivery_tag: int,
+        no_ack: bool,
+    ):
+        message = envelope.message
+        self.body = message.body
+        self.content_type = message.content_type
+        self.correlation_id = message.correlation_id
+        self.message_id = message.message_id
+        self.headers = message.headers
+        self.reply_to = envelope.reply_to
+        self.exchange = envelope.exchange
+        self.routing_key = envelope.routing_key
+        self.redelivered = envelope.redelivered
+        self.delivery_tag = delivery_tag
+        self.channel = channel
+        self.processed = no_ack
+
+    async def ack(self, multiple: bool = False) -> None:
+        if self.processed:
+            return
+        self.processed = True
+        self.channel.settle(self.delivery_tag, requeue=None)
+
+    async def reject(self, requeue: bool = False) -> None:
+        if self.processed:
+            return
+        self.processed = True
+        self.channel.settle(self.delivery_tag, requeue=requeue)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        await self.reject(requeue=requeue)
+
+    @asynccontextmanager
+    async def process(
+        self,
+        requeue: bool = False,
+        ignore_processed: bool = False,
+    ):
+        """ ack on success, reject on exception """
+        try:
+            yield self
+        except BaseException:
+            await self.reject(requeue=requeue)
+            raise
+        else:
+            await self.ack()
+
+
+class Consumer:
+    __slots__ = ('queue', 'channel', 'callback', 'no_ack')
+
+    def __init__(
+        self,
+        queue: 'BrokerQueue',
+        channel: 'LoopbackChannel',
+        callback: Callable[[LoopbackMessage], Awaitable],
+        no_ack: bool,
+    ):
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.no_ack = no_ack
+
+    def has_capacity(self) -> bool:
+        if self.no_ack or not self.channel.prefetch_count:
+            return True
+        return len(self.channel.unacked) < self.channel.prefetch_count
+
+
+class BrokerQueue:
+    def __init__(
+        self,
+        broker: 'LoopbackBroker',
+        name: str,
+        auto_delete: bool = False,
+    ):
+        self.broker = broker
+        self.name = name
+        self.auto_delete = auto_delete
+        self.messages = deque()
+        self.consumers = deque()
+
+    def put(self, envelope: Envelope, front: bool = False) -> None:
+        if front:
+            self.messages.appendleft(envelope)
+        else:
+            self.messages.append(envelope)
+        self.dispatch()
+
+    def dispatch(self) -> None:
+        """
+            deliver messages round-robin to consumers
+            with free prefetch capacity
+        """
+        messages = self.messages
+        consumers = self.consumers
+        while messages and consumers:
+            for _ in range(len(consumers)):
+                consumer = consumers[0]
+                consumers.rotate(-1)
+                if consumer.has_capacity():
+                    break
+            else:
+                return
+            consumer.channel.deliver(consumer, messages.popleft())
+
+    def remove_consumers(self, channel: 'LoopbackChannel') -> None:
+        self.consumers = deque(
+            consumer for consumer in self.consumers
+            if consumer.channel is not channel
+        )
+        if self.auto_delete and not self.consumers:
+            self.broker.delete_queue(self)
+
+
+class BrokerExchange:
+    def __init__(
+        self,
+        broker: 'LoopbackBroker',
+        name: str,
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+    ):
+        if exchange_type not in EXCHANGE_TYPES:
+            raise ValueError(
+                f'Loopback broker does not support {exchange_type} exchange'
+            )
+        self.broker = broker
+        self.name = name
+        self.type = exchange_type
+        # routing key: queues
+        self.bindings: Dict[str, List[BrokerQueue]] = dict()
+        self.patterns: Dict[str, re.Pattern] = dict()
+
+    def bind(self, queue: BrokerQueue, routing_key: str) -> None:
+        queues = self.bindings.setdefault(routing_key, list())
+        if queue not in queues:
+            queues.append(queue)
+        if self.type == ExchangeType.TOPIC:
+            self.patterns[routing_key] = topic_pattern(routing_key)
+
+    def unbind(self, queue: BrokerQueue) -> None:
+        for routing_key, queues in list(self.bindings.items()):
+            if queue in queues:
+                queues.remove(queue)
+            if not queues:
+                del self.bindings[routing_key]
+                self.patterns.pop(routing_key, None)
+
+    def route(self, routing_key: str) -> List[BrokerQueue]:
+        if self.name == '':
+            # default exchange routes to queue by its name
+            queue = self.broker.queues.get(routing_key)
+            return [queue] if queue is not None else []
+        if self.type == ExchangeType.DIRECT:
+            return self.bindings.get(routing_key, [])
+        if self.type == ExchangeType.FANOUT:
+            keys = self.bindings
+        else:
+            keys = [
+                key for key, pattern in self.patterns.items()
+                if pattern.fullmatch(f'{routing_key}.')
+            ]
+        queues = dict()
+        for key in keys:
+            for queue in self.bindings[key]:
+                queues[id(queue)] = queue
+        return list(queues.values())
+
+
+def topic_pattern(routing_key: str) -> re.Pattern:
+    """
+        regex of topic binding: * is one word, # is zero or more
+        words. Matched against routing key with trailing dot,
+        so every word of it ends with dot
+    """
+    pattern = ''
+    for word in routing_key.split('.'):
+        if word == '#':
+            pattern += r'(?:[^.]*\.)*'
+        elif word == '*':
+            pattern += r'[^.]*\.'
+        else:
+            pattern += re.escape(word) + r'\.'
+    return re.compile(pattern)
+
+
+class LoopbackBroker:
+    def __init__(self):
+        self.exchanges: Dict[str, BrokerExchange] = {
+            '': BrokerExchange(self, ''),
+        }
+        self.queues: Dict[str, BrokerQueue] = dict()
+        self.counter = itertools.count(1)
+
+    def delete_queue(self, queue: BrokerQueue) -> None:
+        if self.queues.get(queue.name) is queue:
+            del self.queues[queue.name]
+        for exchange in self.exchanges.values():
+            exchange.unbind(queue)
+
+    def stats(self) -> dict:
+        """ ready messages and consumers of queues """
+        return {
+            name: {
+                'messages': len(queue.messages),
+                'consumers': len(queue.consumers),
+            }
+            for name, queue in self.queues.items()
+        }
+
+
+class LoopbackExchange:
+    """ exchange as seen from channel, like aio_pika.Exchange """
+
+    def __init__(
+        self,
+        exchange: BrokerExchange,
+        channel: 'LoopbackChannel',
+    ):
+        self.exchange = exchange
+        self.channel = channel
+        self.name = exchange.name
+
+    async def publish(
+        self,
+        message: Message,
+        routing_key: str,
+        **kwargs,
+    ) -> None:
+        """ route message, confirm is immediate """
+        reply_to = message.reply_to
+        if reply_to == REPLY_TO:
+            reply_to = self.channel.reply_queue_name
+        for queue in self.exchange.route(routing_key):
+            queue.put(Envelope(message, self.name, routing_key, reply_to))
+
+
+class LoopbackQueue:
+    """ queue as seen from channel, like aio_pika.Queue """
+
+    def __init__(
+        self,
+        queue: BrokerQueue,
+        channel: 'LoopbackChannel',
+    ):
+        self.queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def bind(
+        self,
+        exchange: LoopbackExchange | str,
+        routing_key: Optional[str] = None,
+        **kwargs,
+    ) -> None:
+        exchange_name = getattr(exchange, 'name', exchange)
+        self.channel.broker.exchanges[exchange_name].bind(
+            self.queue,
+            routing_key or self.name,
+        )
+
+    async def consume(
+        self,
+        callback: Callable[[LoopbackMessage], Awaitable],
+        no_ack: bool = False,
+        **kwargs,
+    ) -> None:
+        consumer = Consumer(self.queue, self.channel, callback, no_ack)
+        self.queue.consumers.append(consumer)
+        self.channel.consumers.append(consumer)
+        self.queue.dispatch()
+
+
+class LoopbackChannel:
+    def __init__(
+        self,
+        connection: 'LoopbackConnection',
+        number: int,
+    ):
+        self.connection = connection
+        self.broker = connection.broker
+        self.number = number
+        self.prefetch_count = 0
+        # delivery tag: (queue, envelope) of unacknowledged messages
+        self.unacked: Dict[int, Tuple[BrokerQueue, Envelope]] = dict()
+        self.consumers: List[Consumer] = list()
+        self.tasks = set()
+        self.close_callbacks = set()
+        self.is_closed = False
+        self.delivery_tags = itertools.count(1)
+        self.default_exchange = LoopbackExchange(
+            self.broker.exchanges[''],
+            self,
+        )
+
+    @property
+    def reply_queue_name(self) -> str:
+        return f'{REPLY_TO}.{self.connection.number}.{self.number}'
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(
+        self,
+        name: str,
+        type: ExchangeType = ExchangeType.DIRECT,
+        **kwargs,
+    ) -> LoopbackExchange:
+        exchange = self.broker.exchanges.get(name)
+        if exchange is None:
+            exchange = self.broker.exchanges[name] = BrokerExchange(
+                self.broker,
+                name,
+                type,
+            )
+        return LoopbackExchange(exchange, self)
+
+    async def declare_queue(
+        self,
+        name: Optional[str] = None,
+        auto_delete: bool = False,
+        **kwargs,
+    ) -> LoopbackQueue:
+        if not name:
+            name = f'amq.gen-{next(self.broker.counter)}'
+        queue = self.broker.queues.get(name)
+        if queue is None:
+            queue = self.broker.queues[name] = BrokerQueue(
+                self.broker,
+                name,
+                auto_delete,
+            )
+        return LoopbackQueue(queue, self)
+
+    async def get_queue(
+        self,
+        name: str,
+        ensure: bool = True,
+    ) -> LoopbackQueue:
+        if name == REPLY_TO:
+            return await self.declare_queue(
+                self.reply_queue_name,
+                auto_delete=True,
+            )
+        queue = self.broker.queues.get(name)
+        if queue is None:
+            raise LookupError(f'Queue "{name}" not found')
+        return LoopbackQueue(queue, self)
+
+    def deliver(self, consumer: Consumer, envelope: Envelope) -> None:
+        tag = next(self.delivery_tags)
+        if not consumer.no_ack:
+            self.unacked[tag] = (consumer.queue, envelope)
+        message = LoopbackMessage(envelope, self, tag, consumer.no_ack)
+        # aiormq runs every consumer callback as separate task
+        task = asyncio.ensure_future(consumer.callback(message))
+        self.tasks.add(task)
+        task.add_done_callback(self.callback_done)
+
+    def callback_done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                'Loopback consumer callback failed',
+                exc_info=task.exception(),
+            )
+
+    def settle(self, delivery_tag: int, requeue: Optional[bool]) -> None:
+        """ ack (requeue is None) or reject message """
+        queue, envelope = self.unacked.pop(delivery_tag, (None, None))
+        if queue is None:
+            return
+        if requeue:
+            envelope.redelivered = True
+            queue.put(envelope, front=True)
+        else:
+            queue.dispatch()
+
+    async def close(self, exc: Any = None) -> None:
+        """
+            cancel consumers of channel and requeue
+            its unacknowledged messages
+        """
+        if self.is_closed:
+            return
+        self.is_closed = True
+        queues = {
+            id(consumer.queue): consumer.queue
+            for consumer in self.consumers
+        }
+        self.consumers = list()
+        unacked, self.unacked = self.unacked, dict()
+        for queue, envelope in reversed(list(unacked.values())):
+            envelope.redelivered = True
+            queue.messages.appendleft(envelope)
+        for queue in queues.values():
+            queue.remove_consumers(self)
+            queue.dispatch()
+        for callback in list(self.close_callbacks):
+            callback(self, exc)
+
+
+class LoopbackConnection:
+    def __init__(
+        self,
+        broker: LoopbackBroker,
+    ):
+        self.broker = broker
+        self.number = next(broker.counter)
+        self.channels = list()
+        self.channel_numbers = itertools.count(1)
+        self.reconnect_callbacks = set()
+        self.close_callbacks = set()
+        self.is_closed = False
+
+    async def channel(self, **kwargs) -> LoopbackChannel:
+        channel = LoopbackChannel(self, next(self.channel_numbers))
+        self.channels.append(channel)
+        return channel
+
+    async def close(self, exc: Any = None) -> None:
+        if self.is_closed:
+            return
+        self.is_closed = True
+        for channel in self.channels:
+            await channel.close(exc)
+        self.channels = list()
+
+
+# (host, port): broker, connections to same address share broker
+BROKERS: Dict[Tuple[str, int], LoopbackBroker] = dict()
+
+
+def get_broker(host: str, port: int) -> LoopbackBroker:
+    broker = BROKERS.get((host, port))
+    if broker is None:
+        broker = BROKERS[(host, port)] = LoopbackBroker()
+    return broker
+
+
+async def connect(
+    host: str,
+    port: int,
+    *args,
+    **kwargs,
+) -> LoopbackConnection:
+    return LoopbackConnection(get_broker(host, port))
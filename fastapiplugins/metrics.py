@@ -0,0 +1,115 @@
+from typing import Callable, Tuple
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    def __init__(
+        self,
+        buckets: Tuple[float] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        """
+            cumulative bucket counts, like prometheus 'le' buckets
+        """
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            buckets[bound] = total
+        buckets[float('inf')] = self.count
+        return {
+            'buckets': buckets,
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class Metrics:
+    """
+        In-process counters, gauges and histograms with labels.
+
+        Every observation is also passed to callback as
+        callback(metric_type, name, value, labels), where metric_type
+        is 'counter', 'gauge' or 'histogram', so metrics can be fed
+        to prometheus_client, statsd or anything else.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[str, str, float, dict], None] = None,
+        buckets: Tuple[float] = DEFAULT_BUCKETS,
+    ):
+        self.callback = callback
+        self.buckets = buckets
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+
+    def inc(
+        self,
+        name: str,
+        value: float = 1,
+        **labels,
+    ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+        if self.callback:
+            self.callback('counter', name, value, labels)
+
+    def set(
+        self,
+        name: str,
+        value: float,
+        **labels,
+    ) -> None:
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+        if self.callback:
+            self.callback('gauge', name, value, labels)
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        **labels,
+    ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+        if self.callback:
+            self.callback('histogram', name, value, labels)
+
+    def snapshot(self) -> dict:
+        """
+            {metric_type: {(name, labels): value}}
+        """
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {
+                key: histogram.snapshot()
+                for key, histogram in self.histograms.items()
+            },
+        }
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
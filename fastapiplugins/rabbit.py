@@ -1,16 +1,65 @@
-from typing import Callable, Optional
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple,
+    Union,
+)
+import os
+import time
+import uuid
 import logging
 import asyncio
-
-import ujson
+import warnings
+from contextlib import asynccontextmanager
+from concurrent.futures import (
+    Executor, ProcessPoolExecutor, ThreadPoolExecutor,
+)
+from weakref import WeakKeyDictionary
 
 import aio_pika
+import ujson
 from aio_pika.abc import AbstractRobustConnection
 from aio_pika.pool import Pool
-from aio_pika import Channel, ExchangeType, Message, Queue
+from aio_pika import Channel, Exchange, ExchangeType, Message, Queue
 
 
 from fastapiplugins.base import AbstractPlugin
+from fastapiplugins.exceptions import ExceptionMessage, get_exception_id
+from fastapiplugins.metrics import DEFAULT_BUCKETS, Metrics
+from fastapiplugins import loopback
+from fastapiplugins.serializers import (
+    Serializer,
+    FunctionSerializer,
+    JsonSerializer,
+    get_serializer,
+)
+
+
+ORIGIN = 'PLUGINSRABBIT'
+
+# pseudo-queue of RabbitMQ direct reply-to
+REPLY_TO = 'amq.rabbitmq.reply-to'
+
+# header of RPC reply with error raised by server
+RPC_ERROR_HEADER = 'x-rpc-error'
+
+
+class RpcError(Exception):
+    pass
+
+
+class RpcTimeoutError(RpcError, TimeoutError):
+    pass
+
+
+# transport: connect function
+TRANSPORTS = {
+    'amqp': aio_pika.connect_robust,
+    'loopback': loopback.connect,
+}
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
 
 
 async def autodelete_queue_builder(
@@ -19,33 +68,401 @@ async def autodelete_queue_builder(
     return await channel.declare_queue(auto_delete=True)
 
 
+def shared_queue_name(
+    service_name: str,
+    exchange: str,
+    message_key: str,
+) -> str:
+    return f'{service_name}.{exchange}.{message_key}'
+
+
+async def shared_queue_builder(
+    channel: Channel,
+    name: str,
+) -> Queue:
+    """
+        Durable named queue, shared by all replicas of service:
+        replicas compete for its messages, and messages wait
+        in queue while service restarts.
+    """
+    return await channel.declare_queue(name, durable=True)
+
+
+class Subscriber:
+    """
+        Function subscribed to (exchange, message_key) with its
+        consuming settings:
+
+        prefetch_count -- QoS of subscriber channel, how many
+            unacknowledged messages broker sends at once
+            (max_concurrency if not set)
+        max_concurrency -- how many messages are handled at once
+        serializer -- serializer for messages without content type
+            (or with the same content type),
+            RabbitManager.default_serializer() if not set.
+            Other messages are decoded by their content type
+        max_size, max_wait -- batch mode (see RabbitManager.subscribe_batch),
+            function gets list of up to max_size messages, collected
+            for no longer than max_wait seconds
+        requeue -- requeue rejected messages of batch
+        executor -- run function in executor: "thread", "process"
+            or Executor instance. Function must be sync, message is
+            decoded on event loop and acked after function returns.
+            max_concurrency defaults to cpu count
+        rpc -- function result is sent back to reply_to of message
+            (see RabbitManager.rpc)
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        exchange: str,
+        message_key: str,
+        prefetch_count: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        serializer: Optional[Serializer] = None,
+        max_size: Optional[int] = None,
+        max_wait: float = 1.0,
+        requeue: bool = False,
+        executor: Union[str, Executor, None] = None,
+        rpc: bool = False,
+    ):
+        if executor is not None:
+            if asyncio.iscoroutinefunction(func):
+                raise ValueError(
+                    f'Function "{func}" run in executor must be sync'
+                )
+            if isinstance(executor, str) and executor not in EXECUTORS:
+                raise ValueError(
+                    f'Unknown executor "{executor}", '
+                    f'use one of {list(EXECUTORS)} or Executor instance'
+                )
+            if max_concurrency is None:
+                max_concurrency = os.cpu_count() or 1
+        self.func = func
+        self.exchange = exchange
+        self.message_key = message_key
+        self.prefetch_count = prefetch_count
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.rpc = rpc
+        # executor instance, created by start_consuming for str executor
+        self.pool = executor if isinstance(executor, Executor) else None
+        self.serializer = serializer
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.requeue = requeue
+
+    @property
+    def prefetch(self) -> Optional[int]:
+        """
+            QoS prefetch of subscriber channel. Batch subscribers
+            need at least max_size unacknowledged messages
+        """
+        if self.prefetch_count:
+            return self.prefetch_count
+        if self.max_size:
+            return self.max_size * (self.max_concurrency or 2)
+        return self.max_concurrency
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f'<Subscriber {self.func} on {(self.exchange, self.message_key)}>'
+
+
+class BatchConsumer:
+    """
+        Callback for queue.consume of batch subscriber: collects
+        messages to batches of subscriber.max_size, or less if
+        subscriber.max_wait seconds passed since first message
+        of batch, and handles them with manager.handle_batch.
+        Keeps its timer and tasks, so it can be closed.
+    """
+
+    def __init__(
+        self,
+        manager: type,
+        subscriber: Subscriber,
+    ):
+        self.manager = manager
+        self.subscriber = subscriber
+        self.semaphore = None
+        if subscriber.max_concurrency:
+            self.semaphore = asyncio.Semaphore(subscriber.max_concurrency)
+        self.buffer = list()
+        self.timer = None
+        self.tasks = set()
+        self.closed = False
+
+    async def __call__(self, message: Message) -> None:
+        if self.closed:
+            # left unacknowledged, broker requeues it
+            return
+        self.buffer.append(message)
+        if len(self.buffer) >= self.subscriber.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(
+                self.subscriber.max_wait,
+                self.flush,
+            )
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.buffer or self.closed:
+            return
+        batch, self.buffer = self.buffer, list()
+        task = asyncio.ensure_future(self.handle(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.handled)
+
+    async def handle(self, batch: List[Message]) -> None:
+        if self.semaphore is None:
+            return await self.manager.handle_batch(self.subscriber, batch)
+        async with self.semaphore:
+            return await self.manager.handle_batch(self.subscriber, batch)
+
+    def handled(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                f'{self.subscriber} batch failed',
+                exc_info=task.exception(),
+            )
+
+    async def close(self) -> None:
+        """
+            stop timer, drop buffered messages (broker requeues
+            them with channel close) and wait for batches in work,
+            so they are acked before channel closes
+        """
+        self.closed = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.buffer = list()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
 class RabbitManager(AbstractPlugin):
     class Config:
         CONNECTION_POOL: Pool
         CHANNEL_POOL: Pool
         SUBSCRIBERS: dict = dict()
+        CONSUMER_CHANNELS: list = list()
+        BATCH_CONSUMERS: list = list()
+        # channel: {(exchange name, exchange type): exchange}
+        EXCHANGES: WeakKeyDictionary = WeakKeyDictionary()
+        SERIALIZER: Serializer = JsonSerializer()
+        # deprecated, use SERIALIZER. Overrides are still used
+        # as json serializer (see default_serializer)
         dumps: Callable = ujson.dumps
         loads: Callable = ujson.loads
+        # executors created for subscribers, shut down on stop
+        EXECUTORS: list = list()
+        # RPC client: channel consuming direct reply-to
+        # and {correlation id: (future, serializer)} of calls
+        RPC_CHANNEL: Optional[Channel] = None
+        RPC_CALLS: dict = dict()
+        RPC_LOCK: Optional[asyncio.Lock] = None
+        METRICS: Metrics = None  # see enable_metrics
+        SLOW_HANDLER_THRESHOLD: float = None  # seconds
+        TRANSPORT: str = 'amqp'
 
-    @staticmethod
+    @classmethod
     async def get_connection(
+        cls,
         host: str,
         port: int,
         user: str,
         password: str,
     ) -> AbstractRobustConnection:
-        return await aio_pika.connect_robust(
+        connect = TRANSPORTS[cls.Config.TRANSPORT]
+        connection = await connect(
             host=host,
             port=port,
             login=user,
             password=password
         )
+        connection.reconnect_callbacks.add(cls.forget_exchanges)
+        return connection
+
+    @classmethod
+    def default_serializer(cls) -> Serializer:
+        """
+            Config.SERIALIZER, or serializer of Config.dumps and
+            Config.loads if they are overridden (deprecated)
+        """
+        config = cls.Config
+        if config.dumps is ujson.dumps and config.loads is ujson.loads:
+            return config.SERIALIZER
+        warnings.warn(
+            'RabbitManager.Config.dumps/loads are deprecated, '
+            'set RabbitManager.Config.SERIALIZER instead',
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return FunctionSerializer(config.dumps, config.loads)
+
+    @classmethod
+    def forget_exchanges(cls, *args, **kwargs) -> None:
+        """ drop declared exchanges cache after reconnect """
+        cls.Config.EXCHANGES.clear()
+
+    @classmethod
+    def forget_channel(cls, channel: Channel, *args, **kwargs) -> None:
+        """ drop declared exchanges of closed channel """
+        cls.Config.EXCHANGES.pop(channel, None)
+
+    @classmethod
+    async def declare_exchange(
+        cls,
+        channel: Channel,
+        exchange_name: str,
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+    ) -> Exchange:
+        """
+            Declare exchange once per channel, later calls
+            return cached exchange without broker round-trip.
+        """
+        exchanges = cls.Config.EXCHANGES.get(channel)
+        if exchanges is None:
+            exchanges = cls.Config.EXCHANGES[channel] = dict()
+            channel.close_callbacks.add(cls.forget_channel)
+        exchange = exchanges.get((exchange_name, exchange_type))
+        if exchange is None:
+            exchange = await channel.declare_exchange(
+                exchange_name,
+                exchange_type,
+            )
+            exchanges[(exchange_name, exchange_type)] = exchange
+        return exchange
 
     @classmethod
     async def get_channel(cls) -> Channel:
+        started = time.perf_counter()
         async with cls.Config.CONNECTION_POOL.acquire() as connection:
+            cls.observe_since(
+                'rabbit_acquire_seconds',
+                started,
+                pool='connection',
+            )
             return await connection.channel()
 
+    @classmethod
+    @asynccontextmanager
+    async def pooled_channel(cls) -> AsyncIterator[Channel]:
+        """ channel from CHANNEL_POOL, acquire wait is observed """
+        started = time.perf_counter()
+        async with cls.Config.CHANNEL_POOL.acquire() as channel:
+            cls.observe_since('rabbit_acquire_seconds', started, pool='channel')
+            yield channel
+
+    @classmethod
+    def enable_metrics(
+        cls,
+        callback: Callable[[str, str, float, dict], None] = None,
+        buckets: Tuple[float] = DEFAULT_BUCKETS,
+    ) -> Metrics:
+        """
+            observe received, handled and published messages,
+            handler, publish confirm and channel acquire latency
+            (see Metrics)
+        """
+        cls.Config.METRICS = Metrics(callback=callback, buckets=buckets)
+        return cls.Config.METRICS
+
+    @classmethod
+    def observe_since(cls, name: str, started: float, **labels) -> None:
+        if cls.Config.METRICS is not None:
+            cls.Config.METRICS.observe(
+                name,
+                time.perf_counter() - started,
+                **labels,
+            )
+
+    @classmethod
+    def observe_received(
+        cls,
+        subscriber: Subscriber,
+        messages: List[Message],
+    ) -> None:
+        metrics = cls.Config.METRICS
+        if metrics is None:
+            return
+        labels = {
+            'exchange': subscriber.exchange,
+            'routing_key': subscriber.message_key,
+        }
+        metrics.inc('rabbit_messages_total', len(messages), **labels)
+        redelivered = sum(1 for message in messages if message.redelivered)
+        if redelivered:
+            metrics.inc('rabbit_redelivered_total', redelivered, **labels)
+
+    @classmethod
+    def observe_handled(
+        cls,
+        subscriber: Subscriber,
+        started: float,
+        acked: int,
+        rejected: int,
+    ) -> None:
+        """
+            handler latency, acks and rejects of subscriber,
+            and warning for handler slower than
+            Config.SLOW_HANDLER_THRESHOLD
+        """
+        elapsed = time.perf_counter() - started
+        metrics = cls.Config.METRICS
+        if metrics is not None:
+            labels = {
+                'exchange': subscriber.exchange,
+                'routing_key': subscriber.message_key,
+            }
+            metrics.observe('rabbit_handler_seconds', elapsed, **labels)
+            if acked:
+                metrics.inc('rabbit_acks_total', acked, **labels)
+            if rejected:
+                metrics.inc('rabbit_rejects_total', rejected, **labels)
+        threshold = cls.Config.SLOW_HANDLER_THRESHOLD
+        if threshold is not None and elapsed >= threshold:
+            logging.warning(
+                f'RabbitManager slow handler {subscriber} ({elapsed:.3f}s)'
+            )
+
+    @classmethod
+    async def confirm(
+        cls,
+        exchange: Exchange,
+        message: Message,
+        routing_key: str,
+        routing_key_label: Optional[str] = None,
+    ) -> Any:
+        """
+            publish message and wait for broker confirm,
+            confirm latency is observed. routing_key_label
+            replaces routing_key in metrics labels
+        """
+        started = time.perf_counter()
+        result = await exchange.publish(message, routing_key=routing_key)
+        cls.observe_since(
+            'rabbit_publish_seconds',
+            started,
+            exchange=exchange.name,
+        )
+        if cls.Config.METRICS is not None:
+            cls.Config.METRICS.inc(
+                'rabbit_published_total',
+                exchange=exchange.name,
+                routing_key=routing_key_label or routing_key,
+            )
+        return result
+
     @classmethod
     async def start(
         cls,
@@ -55,8 +472,19 @@ class RabbitManager(AbstractPlugin):
         password: str,
         max_connections: int = 2,
         max_channels: int = 10,
+        transport: str = 'amqp',
     ) -> None:
-        """ start connection and channel pools """
+        """
+            start connection and channel pools.
+            transport="loopback" uses in-memory broker
+            instead of RabbitMQ (see fastapiplugins.loopback)
+        """
+        if transport not in TRANSPORTS:
+            raise ValueError(
+                f'Unknown transport "{transport}", '
+                f'use one of {list(TRANSPORTS)}'
+            )
+        cls.Config.TRANSPORT = transport
         loop = asyncio.get_event_loop()
 
         cls.Config.CONNECTION_POOL = Pool(
@@ -87,6 +515,8 @@ class RabbitManager(AbstractPlugin):
     async def start_consuming(
         cls,
         queue_builder: Optional[Callable] = autodelete_queue_builder,
+        service_name: Optional[str] = None,
+        prefetch_count: Optional[int] = None,
     ) -> None:
         """
             Start consuming messages. Should be called
@@ -100,38 +530,285 @@ class RabbitManager(AbstractPlugin):
             this with importing module with functions-subscribers
             before starting RabbitManager
 
+            With service_name every subscriber consumes from durable
+            queue "{service_name}.{exchange}.{message_key}" shared
+            by all replicas of service (competing consumers), instead
+            of queue of queue_builder. prefetch_count is QoS of
+            subscribers without their own prefetch_count or
+            max_concurrency.
+
             Use logging.getLogger().setLevel(logging.DEBUG)
             to enable output of subscribing process
         """
-        async with cls.Config.CHANNEL_POOL.acquire() as channel:
-            for exchange, message_key in cls.Config.SUBSCRIBERS.keys():
-                queue = await queue_builder(channel)
-                exchange_obj = await channel.declare_exchange(
-                    exchange,
-                    ExchangeType.DIRECT,
+        for subscriber in cls.Config.SUBSCRIBERS.values():
+            # dedicated channel, so QoS of one subscriber
+            # does not limit others
+            channel = await cls.get_channel()
+            cls.Config.CONSUMER_CHANNELS.append(channel)
+            if isinstance(subscriber.executor, str):
+                subscriber.pool = EXECUTORS[subscriber.executor](
+                    max_workers=subscriber.max_concurrency,
                 )
-                await queue.bind(exchange_obj, routing_key=message_key)
-
-                async def callback(message: Message):
-                    async with message.process():
-                        info = message.info()
-                        func = cls.Config.SUBSCRIBERS[
-                            (info.get('exchange'), info.get('routing_key'))
-                        ]
-                        await func(
-                            cls.Config.loads(message.body.decode())
-                        )
-
-                await queue.consume(callback)
-                logging.debug(
-                    "Fuction "
-                    f"{cls.Config.SUBSCRIBERS[(exchange, message_key)]} "
-                    "starts consuming"
+                cls.Config.EXECUTORS.append(subscriber.pool)
+            prefetch = subscriber.prefetch or prefetch_count
+            if prefetch:
+                await channel.set_qos(prefetch_count=prefetch)
+            if service_name:
+                queue = await shared_queue_builder(
+                    channel,
+                    shared_queue_name(
+                        service_name,
+                        subscriber.exchange,
+                        subscriber.message_key,
+                    ),
                 )
+            else:
+                queue = await queue_builder(channel)
+            exchange_obj = await channel.declare_exchange(
+                subscriber.exchange,
+                ExchangeType.DIRECT,
+            )
+            await queue.bind(exchange_obj, routing_key=subscriber.message_key)
+            if subscriber.max_size:
+                await queue.consume(cls.batch_consumer(subscriber))
+            else:
+                await queue.consume(cls.consumer(subscriber))
+            logging.debug(f"{subscriber} starts consuming")
+
+    @classmethod
+    def consumer(
+        cls,
+        subscriber: Subscriber,
+    ) -> Callable[[Message], Awaitable]:
+        """
+            Callback for queue.consume. aio_pika runs every message
+            callback as separate task, semaphore bounds how many
+            of them are handled at once.
+        """
+        semaphore = None
+        if subscriber.max_concurrency:
+            semaphore = asyncio.Semaphore(subscriber.max_concurrency)
+
+        handle = cls.handle_rpc if subscriber.rpc else cls.handle
+
+        async def callback(message: Message):
+            if semaphore is None:
+                return await handle(subscriber, message)
+            async with semaphore:
+                return await handle(subscriber, message)
+        return callback
+
+    @classmethod
+    def batch_consumer(
+        cls,
+        subscriber: Subscriber,
+    ) -> BatchConsumer:
+        """
+            Callback for queue.consume, that collects messages
+            to batches and handles them with handle_batch.
+            Closed by stop().
+        """
+        consumer = BatchConsumer(cls, subscriber)
+        cls.Config.BATCH_CONSUMERS.append(consumer)
+        return consumer
+
+    @classmethod
+    async def handle_batch(
+        cls,
+        subscriber: Subscriber,
+        messages: List[Message],
+    ) -> None:
+        """
+            Call subscriber with list of decoded messages and
+            settle messages by result:
+                None or True -- ack all
+                False or exception raised -- reject all
+                list of results, one per message -- ack message
+                    if its result is None or True, reject otherwise
+            Messages, that can not be decoded, are rejected
+            and not passed to subscriber.
+        """
+        started = time.perf_counter()
+        cls.observe_received(subscriber, messages)
+        payloads = list()
+        decoded = list()
+        rejected = list()
+        for message in messages:
+            serializer = get_serializer(
+                message.content_type,
+                subscriber.serializer,
+                cls.default_serializer(),
+            )
+            try:
+                payloads.append(serializer.loads(message.body))
+            except Exception as e:
+                logging.exception(e)
+                rejected.append(message)
+                continue
+            decoded.append(message)
+        try:
+            result = await cls.call(subscriber, payloads) if payloads else None
+        except Exception as e:
+            logging.exception(e)
+            result = False
+        if (
+            isinstance(result, (list, tuple))
+            and len(result) != len(decoded)
+        ):
+            logging.error(
+                f'{subscriber} returned {len(result)} results '
+                f'for {len(decoded)} messages, batch is rejected'
+            )
+            result = False
+        if isinstance(result, (list, tuple)):
+            acked = list()
+            for message, message_result in zip(decoded, result):
+                if message_result is None or message_result is True:
+                    acked.append(message)
+                else:
+                    rejected.append(message)
+        elif result is False:
+            rejected.extend(decoded)
+            acked = list()
+        else:
+            acked = decoded
+        await asyncio.gather(
+            *(message.ack() for message in acked),
+            *(
+                message.reject(requeue=subscriber.requeue)
+                for message in rejected
+            ),
+        )
+        cls.observe_handled(subscriber, started, len(acked), len(rejected))
+
+    @classmethod
+    async def handle(
+        cls,
+        subscriber: Subscriber,
+        message: Message,
+    ) -> None:
+        serializer = get_serializer(
+            message.content_type,
+            subscriber.serializer,
+            cls.default_serializer(),
+        )
+        started = time.perf_counter()
+        cls.observe_received(subscriber, [message])
+        acked = False
+        try:
+            async with message.process():
+                await cls.call(subscriber, serializer.loads(message.body))
+            acked = True
+        finally:
+            cls.observe_handled(
+                subscriber,
+                started,
+                int(acked),
+                int(not acked),
+            )
+
+    @classmethod
+    async def handle_rpc(
+        cls,
+        subscriber: Subscriber,
+        message: Message,
+    ) -> None:
+        """
+            Call RPC function and publish its result (or error)
+            to reply_to of request with its correlation id.
+            Request is acked after reply is published.
+        """
+        serializer = get_serializer(
+            message.content_type,
+            subscriber.serializer,
+            cls.default_serializer(),
+        )
+        started = time.perf_counter()
+        cls.observe_received(subscriber, [message])
+        acked = False
+        try:
+            async with message.process():
+                await cls.reply(subscriber, message, serializer)
+            acked = True
+        finally:
+            cls.observe_handled(
+                subscriber,
+                started,
+                int(acked),
+                int(not acked),
+            )
+
+    @classmethod
+    async def reply(
+        cls,
+        subscriber: Subscriber,
+        message: Message,
+        serializer: Serializer,
+    ) -> None:
+        try:
+            result = await cls.call(
+                subscriber,
+                serializer.loads(message.body),
+            )
+            # result that can not be serialized is sent as error too
+            reply = cls.build_message(
+                result,
+                serializer,
+                correlation_id=message.correlation_id,
+            )
+        except Exception as e:
+            logging.exception(e)
+            reply = Message(
+                b'',
+                correlation_id=message.correlation_id,
+                headers={RPC_ERROR_HEADER: f'{type(e).__name__}: {e}'},
+            )
+        if not message.reply_to:
+            logging.warning(f'{subscriber} got request without reply_to')
+            return
+        async with cls.pooled_channel() as channel:
+            await cls.confirm(
+                channel.default_exchange,
+                reply,
+                message.reply_to,
+                # reply_to names differ per client channel
+                routing_key_label=REPLY_TO,
+            )
+
+    @classmethod
+    async def call(
+        cls,
+        subscriber: Subscriber,
+        payload: Any,
+    ) -> Any:
+        """
+            Call subscriber with decoded payload, in its executor
+            if subscriber has one.
+        """
+        if subscriber.executor is None:
+            return await subscriber.func(payload)
+        return await asyncio.get_running_loop().run_in_executor(
+            subscriber.pool,
+            subscriber.func,
+            payload,
+        )
 
     @classmethod
     async def stop(cls,) -> None:
         """ stop channel and connection pools """
+        await cls.stop_rpc_client()
+        # buffered messages are requeued by broker when
+        # channels close, so they must not be handled after it
+        for consumer in cls.Config.BATCH_CONSUMERS:
+            await consumer.close()
+        cls.Config.BATCH_CONSUMERS = list()
+        for channel in cls.Config.CONSUMER_CHANNELS:
+            if not channel.is_closed:
+                await channel.close()
+        cls.Config.CONSUMER_CHANNELS = list()
+        for executor in cls.Config.EXECUTORS:
+            executor.shutdown(wait=False, cancel_futures=True)
+        cls.Config.EXECUTORS = list()
         if cls.Config.CHANNEL_POOL:
             if not cls.Config.CHANNEL_POOL.is_closed:
                 await asyncio.ensure_future(cls.Config.CHANNEL_POOL.close())
@@ -156,8 +833,9 @@ class RabbitManager(AbstractPlugin):
                 if kwargs.get('channel', None):
                     return await func(*args, **kwargs)
                 else:
-                    async with cls.Config.CHANNEL_POOL.acquire() as ch:
-                        exchange = await ch.declare_exchange(
+                    async with cls.pooled_channel() as ch:
+                        exchange = await cls.declare_exchange(
+                            ch,
                             exchange_name,
                             exchange_type,
                         )
@@ -172,15 +850,441 @@ class RabbitManager(AbstractPlugin):
         return decorator
 
     @classmethod
-    def subscribe(cls, exchange, message_key):
+    def build_message(
+        cls,
+        payload: Any,
+        serializer: Optional[Serializer] = None,
+        **message_kwargs,
+    ) -> Message:
+        """
+            message with payload serialized by serializer
+            (default_serializer() by default) and its content type
+        """
+        serializer = serializer or cls.default_serializer()
+        return Message(
+            serializer.dumps(payload),
+            content_type=serializer.content_type,
+            **message_kwargs,
+        )
+
+    @classmethod
+    async def publish(
+        cls,
+        exchange: str,
+        routing_key: str,
+        payload,
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+        serializer: Optional[Serializer] = None,
+        **message_kwargs,
+    ):
+        """
+            Publish payload on pooled channel. Exchange is declared
+            once per channel, so publish is one write to broker.
+            message_kwargs are passed to aio_pika.Message.
+        """
+        async with cls.pooled_channel() as channel:
+            exchange_obj = await cls.declare_exchange(
+                channel,
+                exchange,
+                exchange_type,
+            )
+            return await cls.confirm(
+                exchange_obj,
+                cls.build_message(payload, serializer, **message_kwargs),
+                routing_key,
+            )
+
+    @classmethod
+    async def publish_many(
+        cls,
+        exchange: str,
+        routing_key: str,
+        payloads: Iterable,
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+        window: int = 256,
+        serializer: Optional[Serializer] = None,
+        **message_kwargs,
+    ) -> List[Optional[BaseException]]:
+        """
+            Publish payloads back-to-back on one pooled channel.
+
+            Publisher confirms are awaited as window of in-flight
+            messages instead of one by one. Returns list with None
+            for every confirmed message and exception for failed.
+        """
+        return await cls.publish_batch(
+            exchange,
+            [(routing_key, payload) for payload in payloads],
+            exchange_type,
+            window,
+            serializer,
+            **message_kwargs,
+        )
+
+    @classmethod
+    async def publish_batch(
+        cls,
+        exchange: str,
+        messages: List[Tuple[str, Any]],
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+        window: int = 256,
+        serializer: Optional[Serializer] = None,
+        **message_kwargs,
+    ) -> List[Optional[BaseException]]:
+        """ publish_many for (routing_key, payload) pairs """
+        semaphore = asyncio.Semaphore(window)
+        async with cls.pooled_channel() as channel:
+            exchange_obj = await cls.declare_exchange(
+                channel,
+                exchange,
+                exchange_type,
+            )
+
+            async def publish_one(routing_key: str, payload: Any):
+                async with semaphore:
+                    await cls.confirm(
+                        exchange_obj,
+                        cls.build_message(payload, serializer, **message_kwargs),
+                        routing_key,
+                    )
+
+            results = await asyncio.gather(
+                *(
+                    publish_one(routing_key, payload)
+                    for routing_key, payload in messages
+                ),
+                return_exceptions=True,
+            )
+        return [
+            result if isinstance(result, BaseException) else None
+            for result in results
+        ]
+
+    @classmethod
+    async def start_rpc_client(cls) -> Channel:
+        """
+            Channel of RPC client, consuming direct reply-to.
+            Started once per process on first request().
+        """
+        if cls.Config.RPC_LOCK is None:
+            cls.Config.RPC_LOCK = asyncio.Lock()
+        async with cls.Config.RPC_LOCK:
+            channel = cls.Config.RPC_CHANNEL
+            if channel is not None and not channel.is_closed:
+                return channel
+            channel = await cls.get_channel()
+            queue = await channel.get_queue(REPLY_TO, ensure=False)
+            await queue.consume(cls.on_rpc_reply, no_ack=True)
+            cls.Config.RPC_CHANNEL = channel
+            return channel
+
+    @classmethod
+    async def stop_rpc_client(cls) -> None:
+        channel, cls.Config.RPC_CHANNEL = cls.Config.RPC_CHANNEL, None
+        calls, cls.Config.RPC_CALLS = cls.Config.RPC_CALLS, dict()
+        for future, _ in calls.values():
+            if not future.done():
+                future.set_exception(RpcError('RPC client stopped'))
+        if channel is not None and not channel.is_closed:
+            await channel.close()
+
+    @classmethod
+    async def on_rpc_reply(cls, message: Message) -> None:
+        call = cls.Config.RPC_CALLS.pop(message.correlation_id, None)
+        if call is None:
+            # caller timed out
+            return
+        future, serializer = call
+        if future.done():
+            return
+        error = (message.headers or {}).get(RPC_ERROR_HEADER)
+        if error is not None:
+            if isinstance(error, bytes):
+                error = error.decode()
+            future.set_exception(RpcError(error))
+            return
+        serializer = get_serializer(
+            message.content_type,
+            serializer,
+            cls.default_serializer(),
+        )
+        try:
+            future.set_result(serializer.loads(message.body))
+        except Exception as e:
+            future.set_exception(e)
+
+    @classmethod
+    async def request(
+        cls,
+        exchange: str,
+        routing_key: str,
+        payload: Any,
+        timeout: float = 10.0,
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+        serializer: Optional[Serializer] = None,
+        **message_kwargs,
+    ) -> Any:
+        """
+            Call RPC function (see RabbitManager.rpc) and return
+            its result.
+
+            Requests are published on one long-lived channel, that
+            consumes RabbitMQ direct reply-to, and replies are
+            matched to callers by correlation id, so calls need no
+            queue declaration. Raises RpcError with error of server
+            function, RpcTimeoutError if no reply in timeout seconds
+            (request also expires in queue after timeout).
+        """
+        channel = await cls.start_rpc_client()
+        exchange_obj = await cls.declare_exchange(
+            channel,
+            exchange,
+            exchange_type,
+        )
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        cls.Config.RPC_CALLS[correlation_id] = (future, serializer)
+        message_kwargs.setdefault('expiration', timeout)
+        try:
+            await cls.confirm(
+                exchange_obj,
+                cls.build_message(
+                    payload,
+                    serializer,
+                    correlation_id=correlation_id,
+                    reply_to=REPLY_TO,
+                    **message_kwargs,
+                ),
+                routing_key,
+            )
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RpcTimeoutError(
+                f'No reply for {(exchange, routing_key)} in {timeout}s'
+            ) from None
+        finally:
+            cls.Config.RPC_CALLS.pop(correlation_id, None)
+
+    @classmethod
+    def subscribe_batch(
+        cls,
+        exchange: str,
+        message_key: str,
+        max_size: int = 100,
+        max_wait: float = 1.0,
+        prefetch_count: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        serializer: Optional[Serializer] = None,
+        requeue: bool = False,
+        executor: Union[str, Executor, None] = None,
+    ):
+        """
+            Subscribe function to batches of messages: function gets
+            list of up to max_size decoded messages, collected for no
+            longer than max_wait seconds, so it can do one bulk write
+            per batch. Returned value sets acks (see handle_batch).
+        """
         def decorator(func):
 
-            cls.Config.SUBSCRIBERS[(exchange, message_key)] = func
+            cls.Config.SUBSCRIBERS[(exchange, message_key)] = Subscriber(
+                func,
+                exchange,
+                message_key,
+                prefetch_count=prefetch_count,
+                max_concurrency=max_concurrency,
+                serializer=serializer,
+                max_size=max_size,
+                max_wait=max_wait,
+                requeue=requeue,
+                executor=executor,
+            )
+            logging.debug(
+                f'Function "{func}" subscribed to batches '
+                f'as {(exchange, message_key)}'
+            )
+            return func
+        return decorator
+
+    @classmethod
+    def subscribe(
+        cls,
+        exchange: str,
+        message_key: str,
+        prefetch_count: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        serializer: Optional[Serializer] = None,
+        executor: Union[str, Executor, None] = None,
+    ):
+        """
+            Subscribe function to messages of exchange with
+            message_key. See Subscriber for consuming settings.
+
+            CPU-bound function can be run in executor, so it does
+            not block event loop:
+
+                @RabbitManager.subscribe('images', 'resize', executor='process')
+                def resize(payload):
+                    ...
+
+            Function is returned as is, so process executor
+            can pickle it by name.
+        """
+        def decorator(func):
+
+            cls.Config.SUBSCRIBERS[(exchange, message_key)] = Subscriber(
+                func,
+                exchange,
+                message_key,
+                prefetch_count=prefetch_count,
+                max_concurrency=max_concurrency,
+                serializer=serializer,
+                executor=executor,
+            )
             logging.debug(
                 f'Function "{func}" subscribed as {(exchange, message_key)}'
             )
+            return func
+        return decorator
 
-            def wrapper(*args, **kwargs):
-                return func(*args, **kwargs)
-            return wrapper
+    @classmethod
+    def rpc(
+        cls,
+        exchange: str,
+        message_key: str,
+        prefetch_count: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        serializer: Optional[Serializer] = None,
+        executor: Union[str, Executor, None] = None,
+    ):
+        """
+            Subscribe RPC function, its result is sent back to
+            caller of RabbitManager.request():
+
+                @RabbitManager.rpc('users', 'get')
+                async def get_user(payload):
+                    return {'id': payload['id']}
+
+                user = await RabbitManager.request('users', 'get', {'id': 1})
+
+            Error raised by function is sent as RpcError.
+        """
+        def decorator(func):
+
+            cls.Config.SUBSCRIBERS[(exchange, message_key)] = Subscriber(
+                func,
+                exchange,
+                message_key,
+                prefetch_count=prefetch_count,
+                max_concurrency=max_concurrency,
+                serializer=serializer,
+                executor=executor,
+                rpc=True,
+            )
+            logging.debug(
+                f'Function "{func}" serves RPC as {(exchange, message_key)}'
+            )
+            return func
         return decorator
+
+
+class BatchPublisher:
+    """
+        Background batching publisher.
+
+        publish() buffers message and returns future, resolved when
+        broker confirms message (or set with exception). Buffer is
+        sent with RabbitManager.publish_batch when max_batch messages
+        are collected or max_delay seconds passed after first
+        buffered message.
+
+            publisher = BatchPublisher('events', max_batch=500)
+            await publisher.publish('created', payload)
+            ...
+            await publisher.close()
+    """
+
+    def __init__(
+        self,
+        exchange: str,
+        exchange_type: ExchangeType = ExchangeType.DIRECT,
+        max_batch: int = 100,
+        max_delay: float = 0.01,
+        window: int = 256,
+        serializer: Optional[Serializer] = None,
+        manager: type = RabbitManager,
+    ):
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.window = window
+        self.serializer = serializer
+        self.manager = manager
+        self.buffer = list()
+        self.flushing = set()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, routing_key: str, payload: Any) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.buffer.append((routing_key, payload, future))
+        if len(self.buffer) >= self.max_batch:
+            self.flush_soon()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_delay, self.flush_soon)
+        return future
+
+    def flush_soon(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, list()
+        task = asyncio.ensure_future(self.send(batch))
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    async def send(self, batch: List[Tuple[str, Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.manager.publish_batch(
+                self.exchange,
+                [(routing_key, payload) for routing_key, payload, _ in batch],
+                self.exchange_type,
+                self.window,
+                self.serializer,
+            )
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if result is None:
+                future.set_result(None)
+            else:
+                future.set_exception(result)
+
+    async def flush(self) -> None:
+        """ send buffered messages and wait for all confirms """
+        self.flush_soon()
+        if self.flushing:
+            await asyncio.gather(*self.flushing)
+
+    async def close(self) -> None:
+        await self.flush()
+
+
+exceptions = {
+    RpcTimeoutError:
+        ExceptionMessage(
+            id=get_exception_id(ORIGIN, 'rpctimeouterror'),
+            status=504,
+            title="rabbit: RPC timeout",
+        ),
+    RpcError:
+        ExceptionMessage(
+            id=get_exception_id(ORIGIN, 'rpcerror'),
+            status=502,
+            title="rabbit: RPC error",
+        ),
+}
@@ -0,0 +1,179 @@
+"""
+    Message serializers for RabbitManager, chosen by content type.
+
+    Serializers work with bytes both ways, so message body goes
+    to decoder without decoding it to str first.
+"""
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+
+import ujson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def json_dumps(data: Any) -> bytes:
+    return ujson.dumps(data).encode()
+
+
+json_loads = ujson.loads
+
+
+class Serializer:
+    content_type: str = None
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, body: bytes) -> Any:
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__} {self.content_type}>'
+
+
+class JsonSerializer(Serializer):
+    """ ujson, same output as before serializers """
+    content_type = 'application/json'
+
+    def dumps(self, data: Any) -> bytes:
+        return json_dumps(data)
+
+    def loads(self, body: bytes) -> Any:
+        return json_loads(body)
+
+
+class OrjsonSerializer(Serializer):
+    """
+        faster json with orjson. Stricter than ujson: dict keys
+        must be str, ints must fit 64 bits. Not registered by
+        content type, set it per subscriber or publisher, or as
+        RabbitManager.Config.SERIALIZER.
+    """
+    content_type = 'application/json'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError(
+                'OrjsonSerializer needs orjson, pip install orjson'
+            )
+
+    def dumps(self, data: Any) -> bytes:
+        return orjson.dumps(data)
+
+    def loads(self, body: bytes) -> Any:
+        return orjson.loads(body)
+
+
+class FunctionSerializer(Serializer):
+    """
+        json with str dumps/loads functions, like deprecated
+        RabbitManager.Config.dumps and Config.loads
+    """
+    content_type = 'application/json'
+
+    def __init__(
+        self,
+        dumps: Callable[[Any], str],
+        loads: Callable[[str], Any],
+    ):
+        self.dumps_func = dumps
+        self.loads_func = loads
+
+    def dumps(self, data: Any) -> bytes:
+        result = self.dumps_func(data)
+        return result.encode() if isinstance(result, str) else result
+
+    def loads(self, body: bytes) -> Any:
+        return self.loads_func(body.decode())
+
+
+class MsgpackSerializer(Serializer):
+    content_type = 'application/msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError(
+                'MsgpackSerializer needs msgpack, pip install msgpack'
+            )
+
+    def dumps(self, data: Any) -> bytes:
+        return msgpack.packb(data)
+
+    def loads(self, body: bytes) -> Any:
+        return msgpack.unpackb(body)
+
+
+class BytesSerializer(Serializer):
+    """ raw bytes, no serialization """
+    content_type = 'application/octet-stream'
+
+    def dumps(self, data: bytes) -> bytes:
+        return data
+
+    def loads(self, body: bytes) -> bytes:
+        return body
+
+
+class PydanticSerializer(Serializer):
+    """
+        json validated to model with pydantic json parser.
+        Not registered by content type, set it per subscriber
+        or publisher.
+    """
+    content_type = 'application/json'
+
+    def __init__(self, model: BaseModel):
+        self.model = model
+
+    def dumps(self, data: BaseModel | Any) -> bytes:
+        if isinstance(data, BaseModel):
+            return data.model_dump_json().encode()
+        return json_dumps(data)
+
+    def loads(self, body: bytes) -> BaseModel:
+        return self.model.model_validate_json(body)
+
+
+SERIALIZERS = {
+    serializer.content_type: serializer
+    for serializer in (JsonSerializer(), BytesSerializer())
+}
+if msgpack is not None:
+    SERIALIZERS[MsgpackSerializer.content_type] = MsgpackSerializer()
+
+
+def register_serializer(serializer: Serializer) -> None:
+    """ use serializer for messages with its content type """
+    SERIALIZERS[serializer.content_type] = serializer
+
+
+def get_serializer(
+    content_type: Optional[str],
+    preferred: Optional[Serializer] = None,
+    default: Optional[Serializer] = None,
+) -> Serializer:
+    """
+        Serializer for incoming message: preferred (subscriber)
+        serializer or default (RabbitManager.Config.SERIALIZER)
+        if it fits message content type, registered serializer
+        of content type, then preferred or default.
+    """
+    for serializer in (preferred, default):
+        if serializer is not None and (
+            not content_type or content_type == serializer.content_type
+        ):
+            return serializer
+    serializer = SERIALIZERS.get(content_type)
+    if serializer is not None:
+        return serializer
+    return preferred or default or SERIALIZERS[JsonSerializer.content_type]
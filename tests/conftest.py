@@ -0,0 +1,30 @@
+import pytest
+
+from fastapiplugins.controllers import DatabaseManager
+
+from tests.fakes import FakePool
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+        DatabaseManager with fake primary pool and no replicas,
+        Config is restored after test
+    """
+    config = DatabaseManager.Config
+    settings = {
+        'POOL': FakePool(),
+        'REPLICA_POOLS': list(),
+        'REPLICA_DOWN': dict(),
+        'RESULT_CACHE': None,
+        'METRICS': None,
+        'SLOW_QUERY_THRESHOLD': None,
+        'LOADERS': dict(),
+        'CODECS': list(),
+        'INIT': None,
+        'STATEMENTS': dict(),
+        'READY': False,
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(config, name, value)
+    return DatabaseManager
@@ -0,0 +1,141 @@
+"""
+    Fake asyncpg connections and pools, that record calls,
+    for DatabaseManager tests without postgres.
+"""
+from typing import Any, AsyncIterator, Callable, List
+
+from asyncpg.protocol.protocol import _create_record
+
+
+def record(**values) -> Any:
+    """ asyncpg Record with values in keyword order """
+    columns = {name: i for i, name in enumerate(values)}
+    return _create_record(columns, tuple(values.values()))
+
+
+class FakeTransaction:
+    def __init__(self, conn: 'FakeConnection'):
+        self.conn = conn
+
+    async def start(self) -> None:
+        self.conn.depth += 1
+        self.conn.log.append('begin')
+
+    async def commit(self) -> None:
+        self.conn.depth -= 1
+        self.conn.log.append('commit')
+
+    async def rollback(self) -> None:
+        self.conn.depth -= 1
+        self.conn.log.append('rollback')
+
+    async def __aenter__(self) -> 'FakeTransaction':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+
+
+class FakeConnection:
+    """
+        Records (method, query, args) of every call in calls.
+        Results of fetch-like calls are given by
+        result(method, query, args), empty by default.
+    """
+
+    def __init__(self, result: Callable = None):
+        self.result = result or (lambda method, query, args: [])
+        self.calls: List[tuple] = list()
+        # calls and transaction events in order
+        self.log: List[Any] = list()
+        self.depth = 0
+        # typename: kwargs of set_type_codec
+        self.codecs = dict()
+
+    def called(self, method: str, query: str, args: Any) -> Any:
+        self.calls.append((method, query, args))
+        self.log.append(method)
+        return self.result(method, query, args)
+
+    async def fetch(self, query: str, *args, **kwargs) -> list:
+        return self.called('fetch', query, args)
+
+    async def fetchrow(self, query: str, *args, **kwargs) -> Any:
+        return self.called('fetchrow', query, args)
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        return self.called('fetchval', query, args)
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        return self.called('execute', query, args)
+
+    async def executemany(self, query: str, args, **kwargs) -> None:
+        self.called('executemany', query, list(args))
+
+    async def fetchmany(self, query: str, args, **kwargs) -> list:
+        return self.called('fetchmany', query, list(args))
+
+    async def copy_records_to_table(self, table_name: str, **kwargs) -> str:
+        self.called('copy', table_name, kwargs)
+        return f'COPY {len(kwargs["records"])}'
+
+    def cursor(
+        self,
+        query: str,
+        *args,
+        prefetch: int = None,
+    ) -> AsyncIterator:
+        rows = self.called('cursor', query, args)
+        self.prefetch = prefetch
+
+        async def iterate():
+            for row in rows:
+                yield row
+        return iterate()
+
+    async def _get_statement(self, query: str, timeout: float) -> None:
+        self.called('prepare', query, ())
+
+    async def set_type_codec(self, typename: str, **kwargs) -> None:
+        self.codecs[typename] = kwargs
+        self.log.append(f'codec {typename}')
+
+    def transaction(self, **kwargs) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def is_in_transaction(self) -> bool:
+        return self.depth > 0
+
+
+class FakePool:
+    """ pool of one fake connection, down pool raises OSError """
+
+    def __init__(self, conn: FakeConnection = None, down: bool = False):
+        self.conn = conn or FakeConnection()
+        self.down = down
+        self.acquired = 0
+        self.in_use = 0
+        self.closed = False
+
+    async def acquire(self) -> FakeConnection:
+        if self.down:
+            raise OSError('connection refused')
+        self.acquired += 1
+        self.in_use += 1
+        return self.conn
+
+    async def release(self, conn: FakeConnection) -> None:
+        self.in_use -= 1
+
+    async def close(self) -> None:
+        self.closed = True
+
+    def get_size(self) -> int:
+        return 10
+
+    def get_idle_size(self) -> int:
+        return 10 - self.in_use
@@ -0,0 +1,212 @@
+"""
+    SQL text of query builders. Expected queries of insert_q,
+    delete_q, update_q, select_q and select_q_detailed are output
+    of builders before query cache, so cached builders must
+    render exactly the same text.
+"""
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from fastapiplugins.controllers import (
+    BadCursorException,
+    MAX_QUERY_ARGS,
+    count_q,
+    delete_q,
+    encode_cursor,
+    exists_q,
+    insert_q,
+    select_q,
+    select_q_detailed,
+    update_q,
+    upsert_many_q,
+    upsert_q,
+)
+
+
+class Item(BaseModel):
+    id: int
+    body: str
+    v: Optional[int] = None
+
+
+ITEM = Item(id=1, body='x')
+
+
+@pytest.mark.parametrize('query, expected', [
+    (
+        insert_q(ITEM, 't'),
+        (
+            'INSERT INTO \n\tt \n\t(id, body, v) \nVALUES \n'
+            '\t($1, $2, $3) \nRETURNING *\n',
+            1, 'x', None,
+        ),
+    ),
+    (
+        insert_q({'a': 1, 'b': None}, 't'),
+        (
+            'INSERT INTO \n\tt \n\t(a, b) \nVALUES \n'
+            '\t($1, $2) \nRETURNING *\n',
+            1, None,
+        ),
+    ),
+    (
+        delete_q('t', id=1, b=None, c=3),
+        (
+            'DELETE FROM\n\tt\nWHERE\n'
+            '\t(id = $1 AND b is null AND c = $2)\nRETURNING *\n',
+            1, 3,
+        ),
+    ),
+    (
+        update_q(ITEM, 't', id=1, d=None, e=4),
+        (
+            'UPDATE\n\tt\nset\n\tid = $1, body = $2, v = $3\nwhere\n'
+            '\tid = $4 AND d is null AND e = $5\nreturning *\n',
+            1, 'x', None, 1, 4,
+        ),
+    ),
+    (
+        update_q({'a': 1}, 't', id=None),
+        (
+            'UPDATE\n\tt\nset\n\ta = $1\nwhere\n'
+            '\tid is null\nreturning *\n',
+            1,
+        ),
+    ),
+    (
+        select_q('t'),
+        ('SELECT *\nFROM\n\tt\n\n\n',),
+    ),
+    (
+        select_q('t', ordering=['id', 'b']),
+        ('SELECT *\nFROM\n\tt\n\nORDER BY\n\tid, b\n',),
+    ),
+    (
+        select_q('t', id=1, x=None, y=2),
+        (
+            'SELECT *\nFROM\n\tt\nWHERE\n'
+            '\tid = $1 and x is null and y = $2\n\n',
+            1, 2,
+        ),
+    ),
+    (
+        select_q('t', ordering=['id'], id=1),
+        ('SELECT *\nFROM\n\tt\nWHERE\n\tid = $1\nORDER BY\n\tid\n', 1),
+    ),
+    (
+        select_q_detailed('t', Item),
+        ('SELECT\n\tid, body, v\nFROM\n\tt\n\n\n',),
+    ),
+    (
+        select_q_detailed('t', ITEM, id=1),
+        ('SELECT\n\tid, body, v\nFROM\n\tt\nWHERE\n\tid = $1\n\n', 1),
+    ),
+    (
+        select_q_detailed('t', Item, ordering=['id'], id=None, b=1),
+        (
+            'SELECT\n\tid, body, v\nFROM\n\tt\nWHERE\n'
+            '\tid is null and b = $1\nORDER BY\n\tid\n',
+            1,
+        ),
+    ),
+])
+def test_baseline(query, expected):
+    assert query == expected
+
+
+def test_cached_query_follows_values():
+    # same shape, query is taken from cache
+    assert insert_q({'a': 1, 'b': 2}, 't')[1:] == (1, 2)
+    assert insert_q({'a': 3, 'b': 4}, 't')[1:] == (3, 4)
+    # None changes shape of condition, not only its value
+    assert select_q('t', id=1)[0] != select_q('t', id=None)[0]
+    assert select_q('t', id=None)[0] == (
+        'SELECT *\nFROM\n\tt\nWHERE\n\tid is null\n\n'
+    )
+
+
+def test_upsert():
+    assert upsert_q({'id': 1, 'a': 2}, 't', ['id']) == (
+        'INSERT INTO \n\tt \n\t(id, a) \nVALUES \n\t($1, $2) \n'
+        'ON CONFLICT (id) DO UPDATE SET\n\ta = EXCLUDED.a \n'
+        'RETURNING *\n',
+        1, 2,
+    )
+    assert upsert_q({'id': 1, 'a': 2}, 't', ['id'], update_fields=[]) == (
+        'INSERT INTO \n\tt \n\t(id, a) \nVALUES \n\t($1, $2) \n'
+        'ON CONFLICT (id) DO NOTHING \nRETURNING *\n',
+        1, 2,
+    )
+    rows = [{'id': 1, 'a': 2}, {'id': 2, 'a': 3}]
+    assert upsert_many_q(rows, 't', ['id']) == (
+        'INSERT INTO \n\tt \n\t(id, a) \nVALUES \n'
+        '\t($1, $2), \n\t($3, $4) \n'
+        'ON CONFLICT (id) DO UPDATE SET\n\ta = EXCLUDED.a \n'
+        'RETURNING *\n',
+        1, 2, 2, 3,
+    )
+
+
+def test_upsert_many_args_limit():
+    rows = [{'id': i, 'a': i} for i in range(MAX_QUERY_ARGS // 2 + 1)]
+    with pytest.raises(ValueError):
+        upsert_many_q(rows, 't', ['id'])
+
+
+def test_count_and_exists():
+    assert count_q('t') == ('SELECT\n\tcount(*)\nFROM\n\tt\n\n\n',)
+    assert count_q('t', id=1, b=None) == (
+        'SELECT\n\tcount(*)\nFROM\n\tt\nWHERE\n'
+        '\tid = $1 and b is null\n\n',
+        1,
+    )
+    assert exists_q('t', id=1) == (
+        'SELECT EXISTS (\nSELECT\n\t1\nFROM\n\tt\nWHERE\n'
+        '\tid = $1\n\n)\n',
+        1,
+    )
+
+
+def test_keyset():
+    cursor = encode_cursor([5, 'x'])
+    assert select_q('t', ordering=['id'], limit=10) == (
+        'SELECT *\nFROM\n\tt\n\nORDER BY\n\tid\nLIMIT $1\n',
+        10,
+    )
+    assert select_q(
+        't', ordering=['id', 'b'], limit=10, after=cursor, x=1,
+    ) == (
+        'SELECT *\nFROM\n\tt\nWHERE\n'
+        '\tx = $1 and (id, b) > ($2, $3)\nORDER BY\n\tid, b\nLIMIT $4\n',
+        1, 5, 'x', 10,
+    )
+    assert select_q('t', ordering=['id desc', 'b desc'], after=cursor) == (
+        'SELECT *\nFROM\n\tt\nWHERE\n'
+        '\t(id, b) < ($1, $2)\nORDER BY\n\tid desc, b desc\n',
+        5, 'x',
+    )
+    assert select_q_detailed(
+        't', Item, ordering=['id'], limit=5, after=encode_cursor([3]),
+        body='x',
+    ) == (
+        'SELECT\n\tid, body, v\nFROM\n\tt\nWHERE\n'
+        '\tbody = $1 and (id) > ($2)\nORDER BY\n\tid\nLIMIT $3\n',
+        'x', 3, 5,
+    )
+
+
+@pytest.mark.parametrize('ordering, cursor', [
+    # cursor of other ordering
+    (['id'], encode_cursor([5, 'x'])),
+    # mixed directions can not be compared as row
+    (['id', 'b desc'], encode_cursor([5, 'x'])),
+    # no ordering to compare with
+    (None, encode_cursor([5])),
+    # value, that can not be bound to column
+    (['id'], encode_cursor([{'x': [1]}])),
+])
+def test_keyset_mismatch(ordering, cursor):
+    with pytest.raises(BadCursorException):
+        select_q('t', ordering=ordering, after=cursor)
@@ -0,0 +1,89 @@
+import asyncio
+
+from fastapiplugins.controllers import insert_many, render_insert
+
+from tests.fakes import FakeConnection
+
+
+def init(database) -> FakeConnection:
+    conn = FakeConnection()
+    asyncio.run(database.init_connection(conn))
+    return conn
+
+
+def test_json_codecs(database):
+    codecs = init(database).codecs
+    json, jsonb = codecs['json'], codecs['jsonb']
+    # COPY needs binary codecs
+    assert json['format'] == jsonb['format'] == 'binary'
+    assert json['schema'] == jsonb['schema'] == 'pg_catalog'
+    assert json['encoder']({'a': [1, None]}) == b'{"a":[1,null]}'
+    # serialized json is sent as is
+    assert json['encoder']('{"a": 1}') == b'{"a": 1}'
+    assert json['decoder'](b'{"a":1}') == {'a': 1}
+    # binary jsonb starts with version byte
+    assert jsonb['encoder']({'a': 1}) == b'\x01{"a":1}'
+    assert jsonb['encoder'](b'[]') == b'\x01[]'
+    assert jsonb['decoder'](b'\x01{"a":1}') == {'a': 1}
+
+
+def test_custom_json_functions(database, monkeypatch):
+    monkeypatch.setattr(database.Config, 'JSON_DUMPS', lambda value: 'null')
+    monkeypatch.setattr(database.Config, 'JSON_LOADS', lambda data: 'loaded')
+    codecs = init(database).codecs
+    assert codecs['jsonb']['encoder']({'a': 1}) == b'\x01null'
+    assert codecs['json']['decoder'](b'{}') == 'loaded'
+
+
+def test_json_codecs_off(database, monkeypatch):
+    monkeypatch.setattr(database.Config, 'JSON_CODECS', False)
+    assert init(database).codecs == {}
+
+
+def test_codecs_and_init(database, monkeypatch):
+    initialized = []
+
+    async def setup(conn):
+        initialized.append(conn)
+
+    monkeypatch.setattr(database.Config, 'CODECS', [
+        dict(typename='numeric', encoder=str, decoder=float),
+        dict(typename='ltree', encoder=str, decoder=str, schema='public'),
+    ])
+    monkeypatch.setattr(database.Config, 'INIT', setup)
+    conn = init(database)
+    assert conn.codecs['numeric'] == dict(
+        encoder=str, decoder=float, schema='pg_catalog',
+    )
+    assert conn.codecs['ltree']['schema'] == 'public'
+    assert initialized == [conn]
+
+
+def test_copy_needs_binary_codecs(database, monkeypatch):
+    assert database.copy_supported()
+    monkeypatch.setattr(database.Config, 'CODECS', [
+        dict(typename='uuid', encoder=str, decoder=str, format='binary'),
+    ])
+    assert database.copy_supported()
+    monkeypatch.setattr(database.Config, 'CODECS', [
+        dict(typename='numeric', encoder=str, decoder=float),
+    ])
+    assert not database.copy_supported()
+
+
+def test_insert_many_with_text_codecs(database, monkeypatch):
+    monkeypatch.setattr(database.Config, 'CODECS', [
+        dict(typename='numeric', encoder=str, decoder=float),
+    ])
+    conn = FakeConnection()
+    rows = [{'id': i, 'price': i / 2} for i in range(3)]
+    inserted = asyncio.run(insert_many(rows, 'items', chunk_size=2, conn=conn))
+    assert inserted == 3
+    assert conn.calls == [
+        (
+            'executemany',
+            render_insert('items', ['id', 'price']),
+            [(0, 0.0), (1, 0.5)],
+        ),
+        ('executemany', render_insert('items', ['id', 'price']), [(2, 1.0)]),
+    ]
@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+from fastapiplugins.controllers import count_q, estimated_count, select_q
+
+from tests.fakes import FakeConnection
+
+
+def test_reltuples():
+    conn = FakeConnection(lambda method, query, args: 1000)
+    assert asyncio.run(estimated_count('items', conn=conn)) == 1000
+    method, query, args = conn.calls[0]
+    assert 'reltuples' in query
+    assert args == ('items',)
+
+
+def test_never_analyzed_table():
+    # reltuples is -1 before first ANALYZE
+    def result(method, query, args):
+        return -1 if 'reltuples' in query else 3
+
+    conn = FakeConnection(result)
+    assert asyncio.run(estimated_count('items', conn=conn)) == 3
+    assert conn.calls[1] == ('fetchval', *count_q('items'), ())
+
+
+def test_conditions_use_plan():
+    plan = [{'Plan': {'Node Type': 'Seq Scan', 'Plan Rows': 42}}]
+    conn = FakeConnection(lambda method, query, args: json.dumps(plan))
+    count = asyncio.run(estimated_count('items', conn=conn, owner=7))
+    assert count == 42
+    query, *values = select_q('items', owner=7)
+    assert conn.calls == [
+        ('fetchval', f'EXPLAIN (FORMAT JSON) {query}', tuple(values)),
+    ]
@@ -0,0 +1,96 @@
+import base64
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from uuid import UUID
+
+import pytest
+from pydantic import BaseModel
+
+from fastapiplugins.controllers import (
+    BadCursorException,
+    decode_cursor,
+    encode_cursor,
+    next_cursor,
+)
+
+
+class Row(BaseModel):
+    id: int
+    created: datetime
+
+
+def raw_cursor(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def test_round_trip():
+    values = [
+        1,
+        'title',
+        None,
+        1.5,
+        datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        date(2024, 1, 2),
+        time(3, 4, 5),
+        UUID('12345678-1234-5678-1234-567812345678'),
+        Decimal('10.50'),
+        True,
+    ]
+    decoded = decode_cursor(encode_cursor(values))
+    assert decoded == values
+    assert [type(value) for value in decoded] == [
+        type(value) for value in values
+    ]
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(['???>>>'])
+    assert '+' not in cursor and '/' not in cursor
+
+
+def test_unsupported_type():
+    with pytest.raises(TypeError):
+        encode_cursor([object()])
+
+
+def test_next_cursor():
+    created = datetime(2024, 1, 2)
+    rows = [{'id': 1, 'created': created}, {'id': 2, 'created': created}]
+    cursor = next_cursor(rows, ['created', 'id'], limit=2)
+    assert decode_cursor(cursor) == [created, 2]
+    # models are read by attribute
+    models = [Row(**row) for row in rows]
+    assert next_cursor(models, ['created', 'id'], limit=2) == cursor
+    # descending ordering keeps column names only
+    assert decode_cursor(next_cursor(rows, ['id desc'])) == [2]
+
+
+def test_last_page():
+    rows = [{'id': 1}]
+    assert next_cursor(rows, ['id'], limit=2) is None
+    assert next_cursor([], ['id']) is None
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    raw_cursor('not json'),
+    raw_cursor('{"id": 1}'),
+    raw_cursor('1'),
+    raw_cursor('[{"$decimal": "abc"}]'),
+    raw_cursor('[{"$datetime": "yesterday"}]'),
+    raw_cursor('[{"$uuid": "abc"}]'),
+    raw_cursor('[{"$date": 1}]'),
+    raw_cursor('\xff'),
+    # values, that are not scalars of ordering columns
+    encode_cursor([{'x': [1]}]),
+    encode_cursor([[1, 2]]),
+    raw_cursor('[{"$decimal": "1", "extra": 1}]'),
+])
+def test_bad_cursor(cursor):
+    with pytest.raises(BadCursorException):
+        decode_cursor(cursor)
+
+
+def test_bad_cursor_is_value_error():
+    with pytest.raises(ValueError):
+        decode_cursor('not base64!')
@@ -0,0 +1,170 @@
+import pytest
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+
+from fastapiplugins.controllers import (
+    RecordDecoder,
+    decode_records,
+    get_fields,
+    select_q_detailed,
+)
+
+from tests.fakes import record
+
+
+class Item(BaseModel):
+    id: int
+    title: str
+    price: float = 0.0
+
+
+RECORDS = [
+    record(id=1, title='first', price=1.5),
+    record(id=2, title='second', price=2),
+]
+
+
+def test_validate():
+    items = decode_records(RECORDS, Item)
+    assert items == [
+        Item(id=1, title='first', price=1.5),
+        Item(id=2, title='second', price=2.0),
+    ]
+    assert isinstance(items[1].price, float)
+
+
+def test_construct():
+    items = decode_records(RECORDS, Item, 'construct')
+    # construct skips validation, int stays int
+    assert [item.model_dump() for item in items] == [
+        {'id': 1, 'title': 'first', 'price': 1.5},
+        {'id': 2, 'title': 'second', 'price': 2},
+    ]
+    assert items[0].model_fields_set == {'id', 'title', 'price'}
+
+
+def test_construct_fills_defaults():
+    item, = decode_records([record(id=1, title='a')], Item, 'construct')
+    assert item.price == 0.0
+    assert item.model_fields_set == {'id', 'title'}
+
+
+def test_dict():
+    assert decode_records(RECORDS, Item, 'dict') == [
+        {'id': 1, 'title': 'first', 'price': 1.5},
+        {'id': 2, 'title': 'second', 'price': 2},
+    ]
+
+
+def test_tuple():
+    assert decode_records(RECORDS, Item, 'tuple') == [
+        (1, 'first', 1.5),
+        (2, 'second', 2),
+    ]
+
+
+@pytest.mark.parametrize('mode', ['validate', 'construct', 'dict', 'tuple'])
+def test_extra_columns_skipped(mode):
+    records = [record(id=1, created='yesterday', title='first', price=1.5)]
+    assert (
+        decode_records(records, Item, mode)
+        == decode_records(RECORDS[:1], Item, mode)
+    )
+
+
+class PostInit(BaseModel):
+    id: int
+
+    def model_post_init(self, context) -> None:
+        self.id *= 100
+
+
+class Extra(BaseModel):
+    model_config = ConfigDict(extra='allow')
+    id: int
+
+
+class Private(BaseModel):
+    id: int
+    _loaded: bool = PrivateAttr(default=True)
+
+
+@pytest.mark.parametrize('model, row', [
+    (Item, {'id': 1, 'title': 'a', 'price': 1.5}),
+    (PostInit, {'id': 1}),
+    (Extra, {'id': 1}),
+    (Private, {'id': 1}),
+])
+def test_construct_same_as_model_construct(model, row):
+    instance, = decode_records([record(**row)], model, 'construct')
+    expected = model.model_construct(**row)
+    assert instance.model_dump() == expected.model_dump()
+    assert instance.__pydantic_extra__ == expected.__pydantic_extra__
+    assert instance.__pydantic_private__ == expected.__pydantic_private__
+
+
+class Aliased(BaseModel):
+    id: int
+    title: str = Field(alias='name')
+    price: float = Field(validation_alias='cost')
+    tags: list = Field(default_factory=list)
+
+
+# records selected with projection of Aliased
+ALIASED = [
+    record(id=1, name='first', cost=1.5, tags=[]),
+    record(id=2, name='second', cost=2, tags=['a']),
+]
+
+
+def test_projection():
+    assert get_fields(Aliased) == (
+        'id', 'title AS "name"', 'price AS "cost"', 'tags',
+    )
+    assert select_q_detailed('items', Aliased, id=1) == (
+        'SELECT\n\tid, title AS "name", price AS "cost", tags\n'
+        'FROM\n\titems\nWHERE\n\tid = $1\n\n',
+        1,
+    )
+
+
+def test_aliased_validate():
+    assert decode_records(ALIASED, Aliased) == [
+        Aliased(id=1, name='first', cost=1.5),
+        Aliased(id=2, name='second', cost=2.0, tags=['a']),
+    ]
+
+
+def test_aliased_construct():
+    items = decode_records(ALIASED, Aliased, 'construct')
+    assert [item.model_dump() for item in items] == [
+        {'id': 1, 'title': 'first', 'price': 1.5, 'tags': []},
+        {'id': 2, 'title': 'second', 'price': 2, 'tags': ['a']},
+    ]
+
+
+def test_aliased_dict_and_tuple():
+    assert decode_records(ALIASED[:1], Aliased, 'dict') == [
+        {'id': 1, 'title': 'first', 'price': 1.5, 'tags': []},
+    ]
+    assert decode_records(ALIASED[:1], Aliased, 'tuple') == [
+        (1, 'first', 1.5, []),
+    ]
+
+
+@pytest.mark.parametrize('mode', ['construct', 'dict', 'tuple'])
+def test_field_name_columns(mode):
+    # SELECT * returns columns under field names
+    records = [record(id=1, title='first', price=1.5, tags=[])]
+    assert (
+        decode_records(records, Aliased, mode)
+        == decode_records(ALIASED[:1], Aliased, mode)
+    )
+
+
+def test_empty():
+    assert decode_records([], Item) == []
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        RecordDecoder(Item, ('id', 'title'), 'json')
@@ -0,0 +1,110 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from fastapiplugins.controllers import (
+    MAX_QUERY_ARGS,
+    insert_many,
+    render_insert,
+    upsert_many,
+    upsert_many_q,
+)
+
+from tests.fakes import FakeConnection, record
+
+
+class Item(BaseModel):
+    id: int
+    title: str
+
+
+def items(count: int) -> list:
+    return [Item(id=i, title=f'item {i}') for i in range(count)]
+
+
+def test_copy_by_chunks():
+    conn = FakeConnection()
+    inserted = asyncio.run(
+        insert_many(items(5), 'items', chunk_size=2, conn=conn)
+    )
+    assert inserted == 5
+    assert [call[0] for call in conn.calls] == ['copy'] * 3
+    method, table, kwargs = conn.calls[0]
+    assert table == 'items'
+    assert kwargs == {
+        'records': [(0, 'item 0'), (1, 'item 1')],
+        'columns': ['id', 'title'],
+        'schema_name': None,
+    }
+    assert conn.calls[2][2]['records'] == [(4, 'item 4')]
+
+
+def test_copy_schema_and_columns():
+    conn = FakeConnection()
+    rows = [{'title': 'a', 'id': 1, 'extra': True}]
+    asyncio.run(insert_many(
+        rows, 'shop.items', columns=['id', 'title'], conn=conn,
+    ))
+    method, table, kwargs = conn.calls[0]
+    assert table == 'items'
+    assert kwargs['schema_name'] == 'shop'
+    assert kwargs['records'] == [(1, 'a')]
+
+
+def test_async_iterable():
+    async def generate():
+        for item in items(3):
+            yield item
+
+    conn = FakeConnection()
+    inserted = asyncio.run(
+        insert_many(generate(), 'items', chunk_size=2, conn=conn)
+    )
+    assert inserted == 3
+    assert len(conn.calls) == 2
+
+
+def test_returning():
+    conn = FakeConnection(
+        lambda method, query, args: [
+            record(id=row[0], title=row[1]) for row in args
+        ]
+    )
+    inserted = asyncio.run(insert_many(
+        items(3), 'items', chunk_size=2, returning=True, conn=conn,
+    ))
+    assert [row['id'] for row in inserted] == [0, 1, 2]
+    assert [call[0] for call in conn.calls] == ['fetchmany'] * 2
+    assert conn.calls[0][1] == render_insert('items', ['id', 'title'])
+    assert conn.calls[0][2] == [(0, 'item 0'), (1, 'item 1')]
+
+
+def test_empty():
+    conn = FakeConnection()
+    assert asyncio.run(insert_many([], 'items', conn=conn)) == 0
+    assert conn.calls == []
+
+
+def test_upsert_many():
+    conn = FakeConnection(
+        lambda method, query, args: [record(id=args[0])]
+    )
+    upserted = asyncio.run(upsert_many(
+        items(5), 'items', ['id'], chunk_size=2, conn=conn,
+    ))
+    assert [row['id'] for row in upserted] == [0, 2, 4]
+    assert conn.calls[0] == (
+        'fetch',
+        *upsert_many_q(items(2), 'items', ['id'])[:1],
+        (0, 'item 0', 1, 'item 1'),
+    )
+
+
+def test_upsert_many_splits_by_query_args():
+    conn = FakeConnection()
+    # two columns per row
+    rows = MAX_QUERY_ARGS // 2
+    asyncio.run(upsert_many(
+        items(rows + 1), 'items', ['id'], chunk_size=rows + 1, conn=conn,
+    ))
+    assert [len(call[2]) for call in conn.calls] == [rows * 2, 2]
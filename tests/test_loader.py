@@ -0,0 +1,153 @@
+import asyncio
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from fastapiplugins.controllers import select_q
+
+from tests.fakes import FakeConnection, FakePool, record
+
+
+USER_ID = UUID('12345678-1234-5678-1234-567812345678')
+
+
+class User(BaseModel):
+    id: int
+    name: str
+
+
+def users(method: str, query: str, args: tuple) -> list:
+    """ rows of users 1, 2 and 3 with id in ANY($1) """
+    return [
+        record(id=key, name=f'user {key}')
+        for key in sorted(set(args[0]))
+        if key in (1, 2, 3)
+    ]
+
+
+def test_coalesced(database):
+    conn = database.Config.POOL.conn
+    conn.result = users
+
+    async def scenario():
+        return await asyncio.gather(
+            database.load('users', 'id', 1),
+            database.load('users', 'id', 2),
+            database.load('users', 'id', 1),
+            database.load('users', 'id', 3),
+        )
+
+    first, second, again, third = asyncio.run(scenario())
+    assert [row['id'] for row in first] == [1]
+    assert again == first
+    assert [row['id'] for row in second] == [2]
+    assert conn.calls == [
+        ('fetch', select_q('users', id=[1, 2, 3])[0], ([1, 2, 3],)),
+    ]
+
+
+def test_models(database):
+    database.Config.POOL.conn.result = users
+
+    async def scenario():
+        return await asyncio.gather(
+            database.load('users', 'id', 1, model=User),
+            database.load('users', 'id', 4, model=User),
+        )
+
+    assert asyncio.run(scenario()) == [[User(id=1, name='user 1')], []]
+
+
+def test_key_of_other_type(database):
+    # asyncpg accepts str for uuid column, returns UUID
+    database.Config.POOL.conn.result = lambda method, query, args: [
+        record(id=USER_ID, name='user'),
+    ]
+    rows = asyncio.run(database.load('users', 'id', str(USER_ID)))
+    assert [row['id'] for row in rows] == [USER_ID]
+
+
+def test_pinned_caller_reads_primary(database, monkeypatch):
+    replica = FakePool(FakeConnection(users))
+    monkeypatch.setattr(database.Config, 'REPLICA_POOLS', [replica])
+    database.Config.POOL.conn.result = users
+
+    async def pinned_load(key):
+        database.pin_primary()
+        return await database.load('users', 'id', key)
+
+    async def scenario():
+        return await asyncio.gather(
+            database.load('users', 'id', 1),
+            pinned_load(2),
+            database.load('users', 'id', 3),
+        )
+
+    results = asyncio.run(scenario())
+    assert [[row['id'] for row in rows] for rows in results] == [
+        [1], [2], [3],
+    ]
+    assert replica.conn.calls[0][2] == ([1, 3],)
+    assert database.Config.POOL.conn.calls[0][2] == ([2],)
+
+
+def test_error_given_to_every_caller(database):
+    def fail(method, query, args):
+        raise ValueError('database is down')
+
+    database.Config.POOL.conn.result = fail
+
+    async def scenario():
+        return await asyncio.gather(
+            database.load('users', 'id', 1),
+            database.load('users', 'id', 2),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(scenario())
+    assert [type(error) for error in errors] == [ValueError, ValueError]
+
+
+class BlockingConnection(FakeConnection):
+    def __init__(self):
+        super().__init__()
+        self.started = asyncio.Event()
+
+    async def fetch(self, query: str, *args, **kwargs) -> list:
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+def test_cancelled_fetch_cancels_callers(database, monkeypatch):
+    async def scenario():
+        conn = BlockingConnection()
+        monkeypatch.setattr(database.Config, 'POOL', FakePool(conn))
+        callers = [
+            asyncio.ensure_future(database.load('users', 'id', key))
+            for key in (1, 2)
+        ]
+        await conn.started.wait()
+        loader, = database.Config.LOADERS.values()
+        for task in loader.tasks:
+            task.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        return callers, loader
+
+    callers, loader = asyncio.run(scenario())
+    assert all(caller.cancelled() for caller in callers)
+    assert loader.tasks == set()
+    assert database.Config.POOL.in_use == 0
+
+
+def test_cancelled_caller_does_not_break_batch(database):
+    database.Config.POOL.conn.result = users
+
+    async def scenario():
+        cancelled = asyncio.ensure_future(database.load('users', 'id', 1))
+        other = asyncio.ensure_future(database.load('users', 'id', 2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await other
+
+    assert [row['id'] for row in asyncio.run(scenario())] == [2]
+
@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+
+import pytest
+from aio_pika import ExchangeType, Message
+
+from fastapiplugins import loopback
+
+
+HOSTS = itertools.count()
+
+
+@pytest.fixture
+def broker_address():
+    address = (f'loopback-{next(HOSTS)}', 0)
+    yield address
+    loopback.BROKERS.pop(address, None)
+
+
+async def channel(address) -> loopback.LoopbackChannel:
+    connection = await loopback.connect(*address)
+    return await connection.channel()
+
+
+@pytest.mark.parametrize('binding, routing_key, routed', [
+    ('orders.created', 'orders.created', True),
+    ('orders.*', 'orders.created', True),
+    ('orders.*', 'orders.created.eu', False),
+    ('orders.#', 'orders.created.eu', True),
+    ('orders.#', 'orders', True),
+    ('#.eu', 'orders.created.eu', True),
+    ('*.created', 'users.deleted', False),
+    ('#', 'anything.at.all', True),
+])
+def test_topic_routing(broker_address, binding, routing_key, routed):
+    async def scenario():
+        ch = await channel(broker_address)
+        exchange = await ch.declare_exchange('events', ExchangeType.TOPIC)
+        queue = await ch.declare_queue('events')
+        await queue.bind(exchange, binding)
+        await exchange.publish(Message(b'1'), routing_key)
+        return len(queue.queue.messages)
+
+    assert asyncio.run(scenario()) == int(routed)
+
+
+def test_direct_and_fanout(broker_address):
+    async def scenario():
+        ch = await channel(broker_address)
+        direct = await ch.declare_exchange('direct')
+        fanout = await ch.declare_exchange('fanout', ExchangeType.FANOUT)
+        first = await ch.declare_queue('first')
+        second = await ch.declare_queue('second')
+        await first.bind(direct, 'a')
+        await second.bind(direct, 'b')
+        await first.bind(fanout, 'x')
+        await second.bind(fanout, 'y')
+        await direct.publish(Message(b'1'), 'a')
+        await fanout.publish(Message(b'2'), 'z')
+        # default exchange routes by queue name
+        await ch.default_exchange.publish(Message(b'3'), 'second')
+        return loopback.get_broker(*broker_address).stats()
+
+    assert asyncio.run(scenario()) == {
+        'first': {'messages': 2, 'consumers': 0},
+        'second': {'messages': 2, 'consumers': 0},
+    }
+
+
+def test_prefetch_and_requeue(broker_address):
+    async def scenario():
+        ch = await channel(broker_address)
+        await ch.set_qos(prefetch_count=2)
+        queue = await ch.declare_queue('work')
+        received = []
+
+        async def callback(message):
+            received.append(message)
+
+        await queue.consume(callback)
+        for body in (b'1', b'2', b'3'):
+            await ch.default_exchange.publish(Message(body), 'work')
+        await asyncio.sleep(0)
+        # third message waits for free prefetch slot
+        assert [message.body for message in received] == [b'1', b'2']
+        await received[0].reject(requeue=True)
+        await asyncio.sleep(0)
+        redelivered = received[2]
+        assert (redelivered.body, redelivered.redelivered) == (b'1', True)
+        await received[1].ack()
+        await redelivered.ack()
+        await asyncio.sleep(0)
+        assert received[3].body == b'3'
+        await received[3].ack()
+        return len(ch.unacked), len(queue.queue.messages)
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+def test_close_requeues_unacked(broker_address):
+    async def scenario():
+        ch = await channel(broker_address)
+        queue = await ch.declare_queue('work')
+        await queue.consume(lambda message: asyncio.sleep(0))
+        for body in (b'1', b'2'):
+            await ch.default_exchange.publish(Message(body), 'work')
+        await asyncio.sleep(0)
+        await ch.close()
+        return [envelope.message.body for envelope in queue.queue.messages]
+
+    assert asyncio.run(scenario()) == [b'1', b'2']
+
+
+def test_auto_delete(broker_address):
+    async def scenario():
+        ch = await channel(broker_address)
+        queue = await ch.declare_queue(auto_delete=True)
+        await queue.consume(lambda message: asyncio.sleep(0))
+        await ch.close()
+        return loopback.get_broker(*broker_address).stats()
+
+    assert asyncio.run(scenario()) == {}
+
+
+def test_reply_to(broker_address):
+    async def scenario():
+        client = await channel(broker_address)
+        server = await channel(broker_address)
+        replies = []
+
+        async def on_reply(message):
+            replies.append(message)
+
+        reply_queue = await client.get_queue(loopback.REPLY_TO)
+        await reply_queue.consume(on_reply, no_ack=True)
+        requests = await server.declare_queue('rpc')
+        request = Message(b'ping', reply_to=loopback.REPLY_TO)
+        await client.default_exchange.publish(request, 'rpc')
+        received = requests.queue.messages[0]
+        await server.default_exchange.publish(
+            Message(b'pong'),
+            received.reply_to,
+        )
+        await asyncio.sleep(0)
+        return [message.body for message in replies]
+
+    assert asyncio.run(scenario()) == [b'pong']
+
+
+def test_connections_share_broker(broker_address):
+    async def scenario():
+        first = await channel(broker_address)
+        second = await channel(broker_address)
+        await first.declare_queue('shared')
+        with pytest.raises(LookupError):
+            await second.get_queue('missing')
+        return await second.get_queue('shared')
+
+    assert asyncio.run(scenario()).name == 'shared'
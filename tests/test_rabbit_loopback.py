@@ -0,0 +1,303 @@
+"""
+    RabbitManager consumers and RPC over in-memory loopback
+    broker, every test runs on its own broker and event loop.
+"""
+import asyncio
+import itertools
+
+import pytest
+import ujson
+
+from fastapiplugins import loopback
+from fastapiplugins.rabbit import RabbitManager, RpcError, RpcTimeoutError
+from fastapiplugins.serializers import JsonSerializer, MsgpackSerializer
+
+
+BROKER_NUMBERS = itertools.count()
+
+
+@pytest.fixture(autouse=True)
+def rabbit(monkeypatch):
+    """ subscribers of test only, Config restored after test """
+    config = RabbitManager.Config
+    monkeypatch.setattr(config, 'SUBSCRIBERS', dict())
+    monkeypatch.setattr(config, 'TRANSPORT', config.TRANSPORT)
+    monkeypatch.setattr(config, 'SERIALIZER', config.SERIALIZER)
+    monkeypatch.setattr(config, 'dumps', config.dumps)
+    monkeypatch.setattr(config, 'loads', config.loads)
+    monkeypatch.setattr(config, 'RPC_LOCK', None)
+    monkeypatch.setattr(config, 'METRICS', config.METRICS)
+    return RabbitManager
+
+
+def run(scenario, **consuming) -> loopback.LoopbackBroker:
+    """
+        run scenario coroutine function with started and consuming
+        RabbitManager, returns broker to check its queues
+    """
+    host = f'tests-{next(BROKER_NUMBERS)}'
+
+    async def main():
+        await RabbitManager.start(
+            host, 0, 'guest', 'guest', transport='loopback',
+        )
+        try:
+            await RabbitManager.start_consuming(**consuming)
+            await scenario()
+        finally:
+            await RabbitManager.stop()
+
+    asyncio.run(main())
+    return loopback.BROKERS.pop((host, 0))
+
+
+async def wait_for(condition, timeout: float = 2.0) -> None:
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.001)
+    await asyncio.wait_for(wait(), timeout)
+
+
+def consume(payloads: list, **publish_kwargs) -> list:
+    """ publish payloads to subscriber of test, return received """
+    received = []
+
+    @RabbitManager.subscribe('orders', 'created')
+    async def created(payload):
+        received.append(payload)
+
+    async def scenario():
+        await RabbitManager.publish_many(
+            'orders', 'created', payloads, **publish_kwargs,
+        )
+        await wait_for(lambda: len(received) == len(payloads))
+
+    run(scenario)
+    return received
+
+
+def test_consume():
+    received = []
+
+    @RabbitManager.subscribe('orders', 'created')
+    async def created(payload):
+        received.append(payload)
+
+    async def scenario():
+        await RabbitManager.publish('orders', 'created', {'id': 1})
+        await RabbitManager.publish_many(
+            'orders', 'created', [{'id': 2}, {'id': 3}],
+        )
+        await RabbitManager.publish('orders', 'deleted', {'id': 4})
+        await wait_for(lambda: len(received) == 3)
+
+    broker = run(scenario)
+    assert sorted(payload['id'] for payload in received) == [1, 2, 3]
+    assert not any(stats['messages'] for stats in broker.stats().values())
+
+
+class MarkedSerializer(JsonSerializer):
+    """ json, that marks decoded payloads """
+
+    def loads(self, body: bytes):
+        return ('marked', super().loads(body))
+
+
+def test_config_serializer(monkeypatch):
+    monkeypatch.setattr(RabbitManager.Config, 'SERIALIZER', MarkedSerializer())
+    assert consume([{'id': 1}]) == [('marked', {'id': 1})]
+
+
+def test_deprecated_config_loads(monkeypatch):
+    monkeypatch.setattr(
+        RabbitManager.Config, 'loads', lambda body: ('custom', body),
+    )
+    with pytest.warns(DeprecationWarning):
+        received = consume([{'id': 1}])
+    assert received == [('custom', '{"id":1}')]
+
+
+def test_deprecated_config_dumps(monkeypatch):
+    monkeypatch.setattr(
+        RabbitManager.Config, 'dumps', lambda data: ujson.dumps([data]),
+    )
+    with pytest.warns(DeprecationWarning):
+        received = consume([{'id': 1}])
+    assert received == [[{'id': 1}]]
+
+
+def test_content_type_negotiation(monkeypatch):
+    # message of other content type is decoded by registered serializer
+    monkeypatch.setattr(RabbitManager.Config, 'SERIALIZER', MarkedSerializer())
+    received = consume([{'id': 1}], serializer=MsgpackSerializer())
+    assert received == [{'id': 1}]
+
+
+def test_batch_ack_reject():
+    batches = []
+    seen = set()
+
+    @RabbitManager.subscribe_batch(
+        'orders', 'created', max_size=3, max_wait=0.01, requeue=True,
+    )
+    async def created(payloads):
+        batches.append(sorted(payloads))
+        # odd payloads are rejected on first delivery and requeued
+        results = [payload % 2 == 0 or payload in seen for payload in payloads]
+        seen.update(payloads)
+        return results
+
+    async def scenario():
+        await RabbitManager.publish_many('orders', 'created', [1, 2, 3])
+        await wait_for(lambda: sum(map(len, batches)) == 5)
+        await asyncio.sleep(0.05)
+
+    broker = run(scenario)
+    assert batches[0] == [1, 2, 3]
+    handled = [payload for batch in batches for payload in batch]
+    assert sorted(handled) == [1, 1, 2, 3, 3]
+    assert not any(stats['messages'] for stats in broker.stats().values())
+
+
+def test_batch_wrong_result_length_rejects():
+    batches = []
+
+    @RabbitManager.subscribe_batch(
+        'orders', 'created', max_size=3, max_wait=0.01, requeue=True,
+    )
+    async def created(payloads):
+        batches.append(sorted(payloads))
+        if len(batches) == 1:
+            # one result for three messages, whole batch is requeued
+            return [True]
+        return None
+
+    async def scenario():
+        await RabbitManager.publish_many('orders', 'created', [1, 2, 3])
+        await wait_for(lambda: len(batches) == 2)
+
+    broker = run(scenario)
+    assert batches == [[1, 2, 3], [1, 2, 3]]
+    assert not any(stats['messages'] for stats in broker.stats().values())
+
+
+def test_batch_exception_rejects():
+    batches = []
+
+    @RabbitManager.subscribe_batch(
+        'orders', 'created', max_size=2, max_wait=0.01,
+    )
+    async def created(payloads):
+        batches.append(payloads)
+        raise ValueError('database is down')
+
+    async def scenario():
+        await RabbitManager.publish_many('orders', 'created', [1, 2])
+        await wait_for(lambda: batches)
+        await asyncio.sleep(0.05)
+
+    broker = run(scenario)
+    # rejected without requeue, not redelivered
+    assert batches == [[1, 2]]
+    assert not any(stats['messages'] for stats in broker.stats().values())
+
+
+def test_stop_drops_buffered_batch():
+    batches = []
+
+    @RabbitManager.subscribe_batch(
+        'orders', 'created', max_size=10, max_wait=60,
+    )
+    async def created(payloads):
+        batches.append(payloads)
+
+    async def scenario():
+        await RabbitManager.publish_many('orders', 'created', [1, 2, 3])
+        await asyncio.sleep(0.05)
+
+    broker = run(scenario, service_name='tests')
+    # buffered messages are not handled after stop, broker requeues them
+    assert batches == []
+    assert broker.stats()['tests.orders.created']['messages'] == 3
+
+
+def test_rpc():
+    @RabbitManager.rpc('users', 'get')
+    async def get_user(payload):
+        return {'id': payload['id'], 'name': 'user'}
+
+    async def scenario():
+        results = await asyncio.gather(*(
+            RabbitManager.request('users', 'get', {'id': i})
+            for i in range(5)
+        ))
+        assert results == [{'id': i, 'name': 'user'} for i in range(5)]
+
+    run(scenario)
+
+
+def test_rpc_error():
+    @RabbitManager.rpc('users', 'get')
+    async def get_user(payload):
+        raise LookupError(f'no user {payload["id"]}')
+
+    async def scenario():
+        with pytest.raises(RpcError, match='LookupError: no user 1'):
+            await RabbitManager.request('users', 'get', {'id': 1})
+
+    run(scenario)
+
+
+def test_rpc_unserializable_result():
+    @RabbitManager.rpc('users', 'get')
+    async def get_user(payload):
+        return object()
+
+    async def scenario():
+        with pytest.raises(RpcError):
+            await RabbitManager.request('users', 'get', {'id': 1}, timeout=1)
+
+    run(scenario)
+
+
+def test_rpc_timeout():
+    @RabbitManager.rpc('users', 'get')
+    async def get_user(payload):
+        await asyncio.sleep(1)
+
+    async def scenario():
+        with pytest.raises(RpcTimeoutError):
+            await RabbitManager.request(
+                'users', 'get', {'id': 1}, timeout=0.05,
+            )
+        assert RabbitManager.Config.RPC_CALLS == dict()
+
+    run(scenario)
+
+
+def test_rpc_timeout_is_timeout_error():
+    async def scenario():
+        # no server for routing key
+        with pytest.raises(TimeoutError):
+            await RabbitManager.request('users', 'get', 1, timeout=0.05)
+
+    run(scenario)
+
+
+def test_metrics_off_by_default():
+    assert RabbitManager.Config.METRICS is None
+    assert consume([1]) == [1]
+
+
+def test_metrics():
+    observed = []
+    metrics = RabbitManager.enable_metrics(
+        lambda *observation: observed.append(observation),
+    )
+    consume([1, 2, 3])
+    labels = (('exchange', 'orders'), ('routing_key', 'created'))
+    assert metrics.counters[('rabbit_published_total', labels)] == 3
+    assert metrics.counters[('rabbit_messages_total', labels)] == 3
+    assert metrics.counters[('rabbit_acks_total', labels)] == 3
+    assert ('rabbit_handler_seconds', labels) in metrics.histograms
+    assert ('counter', 'rabbit_acks_total', 1, dict(labels)) in observed
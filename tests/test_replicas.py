@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from fastapiplugins.controllers import insert_q, primary_pinned, select_q
+
+from tests.fakes import FakePool
+
+
+@pytest.fixture
+def replicas(database, monkeypatch):
+    pools = [FakePool(), FakePool()]
+    monkeypatch.setattr(database.Config, 'REPLICA_POOLS', pools)
+    return pools
+
+
+async def read_pool(database) -> object:
+    """ pool readonly connection is taken from """
+    async with database.acquire(readonly=True) as conn:
+        pools = [database.Config.POOL, *database.Config.REPLICA_POOLS]
+        return next(pool for pool in pools if pool.conn is conn)
+
+
+def test_readonly_round_robin(database, replicas):
+    async def scenario():
+        return [await read_pool(database) for _ in range(4)]
+
+    used = asyncio.run(scenario())
+    assert set(map(id, used)) == set(map(id, replicas))
+    assert database.Config.POOL.acquired == 0
+
+
+def test_read_does_not_pin(database, replicas):
+    async def scenario():
+        async with database.connection() as conn:
+            await conn.fetch(*select_q('items', id=1))
+        async with database.acquire() as conn:
+            await conn.execute('UPDATE items SET title = NULL')
+        return await read_pool(database)
+
+    assert asyncio.run(scenario()) in replicas
+
+
+@pytest.mark.parametrize('query', [
+    insert_q({'id': 1}, 'items'),
+    ('UPDATE items SET title = NULL',),
+])
+def test_write_pins(database, replicas, query):
+    async def scenario():
+        async with database.connection() as conn:
+            await conn.execute(*query)
+        return await read_pool(database)
+
+    assert asyncio.run(scenario()) is database.Config.POOL
+    # pin belongs to context of request
+    assert not primary_pinned.get()
+    assert asyncio.run(read_pool(database)) in replicas
+
+
+def test_decorated_write_pins(database, replicas):
+    @database.acqure_connection()
+    async def create(conn=None):
+        await conn.fetchrow(*insert_q({'id': 1}, 'items'))
+
+    @database.acqure_connection()
+    async def get(conn=None):
+        await conn.fetchrow(*select_q('items', id=1))
+
+    async def scenario():
+        await get()
+        before = await read_pool(database)
+        await create()
+        return before, await read_pool(database)
+
+    before, after = asyncio.run(scenario())
+    assert before in replicas
+    assert after is database.Config.POOL
+
+
+def test_read_your_writes_off(database, replicas, monkeypatch):
+    monkeypatch.setattr(database.Config, 'READ_YOUR_WRITES', False)
+
+    async def scenario():
+        async with database.connection() as conn:
+            await conn.execute(*insert_q({'id': 1}, 'items'))
+        return await read_pool(database)
+
+    assert asyncio.run(scenario()) in replicas
+
+
+def test_pin_primary(database, replicas):
+    async def scenario():
+        database.pin_primary()
+        pinned = await read_pool(database)
+        database.pin_primary(False)
+        return pinned, await read_pool(database)
+
+    pinned, unpinned = asyncio.run(scenario())
+    assert pinned is database.Config.POOL
+    assert unpinned in replicas
+
+
+def test_replica_down(database, replicas):
+    down, up = replicas
+    down.down = True
+
+    async def scenario():
+        return [await read_pool(database) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [up] * 3
+    assert down in database.Config.REPLICA_DOWN
+    assert database.replica_pools() == [up]
+
+
+def test_all_replicas_down(database, replicas):
+    for pool in replicas:
+        pool.down = True
+    assert asyncio.run(read_pool(database)) is database.Config.POOL
+    assert database.replica_pools() == []
@@ -0,0 +1,172 @@
+import asyncio
+
+from fastapiplugins.cache import MISSING, QueryCache, ResultCache
+from fastapiplugins.controllers import (
+    ConnectionProxy,
+    insert_q,
+    select_q,
+    update_q,
+)
+
+from tests.fakes import FakeConnection
+
+
+def proxy(cache: ResultCache, conn: FakeConnection = None) -> ConnectionProxy:
+    return ConnectionProxy(conn or FakeConnection(), cache)
+
+
+def reads(conn: FakeConnection) -> int:
+    return sum(1 for call in conn.calls if call[0] == 'fetch')
+
+
+def test_read_is_cached():
+    cache = ResultCache()
+    conn = FakeConnection(lambda method, query, args: [args])
+    items = proxy(cache, conn)
+
+    async def scenario():
+        first = await items.fetch(*select_q('items', id=1))
+        second = await items.fetch(*select_q('items', id=1))
+        other = await items.fetch(*select_q('items', id=2))
+        return first, second, other
+
+    assert asyncio.run(scenario()) == ([(1,)], [(1,)], [(2,)])
+    assert reads(conn) == 2
+    assert cache.stats()['hits'] == 1
+
+
+def test_write_invalidates_table():
+    cache = ResultCache()
+    conn = FakeConnection()
+    items = proxy(cache, conn)
+
+    async def scenario():
+        await items.fetch(*select_q('items', id=1))
+        await items.fetch(*select_q('users', id=1))
+        await items.execute(*update_q({'title': 'a'}, 'items', id=1))
+        await items.fetch(*select_q('items', id=1))
+        await items.fetch(*select_q('users', id=1))
+
+    asyncio.run(scenario())
+    # users result survived write to items
+    assert reads(conn) == 3
+
+
+def test_raw_sql_is_not_cached():
+    conn = FakeConnection()
+    items = proxy(ResultCache(), conn)
+
+    async def scenario():
+        for _ in range(2):
+            await items.fetch('SELECT * FROM items WHERE id = $1', 1)
+
+    asyncio.run(scenario())
+    assert reads(conn) == 2
+
+
+def test_read_in_transaction_is_not_cached():
+    conn = FakeConnection()
+    items = proxy(ResultCache(), conn)
+
+    async def scenario():
+        async with items.transaction():
+            await items.fetch(*select_q('items', id=1))
+        await items.fetch(*select_q('items', id=1))
+
+    asyncio.run(scenario())
+    assert reads(conn) == 2
+
+
+def test_write_in_transaction_invalidates_on_commit():
+    cache = ResultCache()
+    writer_conn = FakeConnection()
+    reader_conn = FakeConnection(lambda method, query, args: ['old'])
+    writer = proxy(cache, writer_conn)
+    reader = proxy(cache, reader_conn)
+
+    async def scenario():
+        async with writer.transaction():
+            await writer.execute(*insert_q({'id': 1}, 'items'))
+            # other connection does not see uncommitted row
+            # and caches old result
+            await reader.fetch(*select_q('items', id=1))
+        reader_conn.result = lambda method, query, args: ['new']
+        return await reader.fetch(*select_q('items', id=1))
+
+    assert asyncio.run(scenario()) == ['new']
+    assert reads(reader_conn) == 2
+
+
+def test_rollback_forgets_written_tables():
+    cache = ResultCache()
+    items = proxy(cache)
+
+    async def scenario():
+        try:
+            async with items.transaction():
+                await items.execute(*insert_q({'id': 1}, 'items'))
+                raise ValueError
+        except ValueError:
+            pass
+        # rolled back write is not invalidated by later commit
+        async with items.transaction():
+            pass
+
+    asyncio.run(scenario())
+    assert cache.stats()['invalidations'] == 1
+    assert items._written == set()
+
+
+def test_result_of_concurrent_write_is_not_cached():
+    cache = ResultCache()
+
+    def result(method, query, args):
+        # write to table commits while read is running
+        cache.invalidate('items')
+        return ['stale']
+
+    conn = FakeConnection(result)
+    items = proxy(cache, conn)
+
+    async def scenario():
+        await items.fetch(*select_q('items', id=1))
+        await items.fetch(*select_q('items', id=1))
+
+    asyncio.run(scenario())
+    assert reads(conn) == 2
+
+
+def test_generation():
+    cache = ResultCache()
+    generation = cache.generation('items')
+    cache.invalidate('items')
+    cache.set('key', 'items', 'stale', generation)
+    assert cache.get('key') is MISSING
+    cache.set('key', 'items', 'fresh', cache.generation('items'))
+    assert cache.get('key') == 'fresh'
+
+
+def test_ttl_and_size():
+    cache = ResultCache(maxsize=2, ttl=60)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, 'items', key)
+    assert cache.get('a') is MISSING
+    assert cache.get('c') == 'c'
+    assert cache.stats()['evictions'] == 1
+    expired = ResultCache(ttl=0)
+    expired.set('a', 'items', 'a')
+    assert expired.get('a') is MISSING
+
+
+def test_query_cache_tables_evicted_with_templates():
+    queries = QueryCache(maxsize=2)
+    first = queries.get_or_build(('select', 'a'), lambda: 'SELECT a')
+    queries.get_or_build(('select', 'b'), lambda: 'SELECT b')
+    # second key with the same text
+    queries.get_or_build(('select', 'b', 1), lambda: 'SELECT b')
+    assert first not in queries.tables
+    assert queries.tables == {'SELECT b': ('select', 'b')}
+    queries.get_or_build(('select', 'c'), lambda: 'SELECT c')
+    # text is kept while one of its keys is cached
+    assert set(queries.tables) == {'SELECT b', 'SELECT c'}
+    assert queries.stats()['size'] == 2
@@ -0,0 +1,50 @@
+import pytest
+import ujson
+
+from fastapiplugins.serializers import (
+    BytesSerializer,
+    FunctionSerializer,
+    JsonSerializer,
+    MsgpackSerializer,
+    SERIALIZERS,
+    get_serializer,
+)
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+
+@pytest.mark.parametrize('data', [
+    {'id': 1, 'tags': ['a', None], 'price': 1.5},
+    {1: 'int keys'},
+    2 ** 70,
+])
+def test_json_like_before_serializers(data):
+    # ujson, as RabbitManager used before serializers
+    body = JsonSerializer().dumps(data)
+    assert body == ujson.dumps(data).encode()
+    assert JsonSerializer().loads(body) == ujson.loads(ujson.dumps(data))
+
+
+def test_get_serializer():
+    preferred = MsgpackSerializer()
+    default = JsonSerializer()
+    assert get_serializer(MSGPACK, preferred, default) is preferred
+    assert get_serializer(None, preferred, default) is preferred
+    # default fits content type before registered serializer
+    assert get_serializer(JSON, preferred, default) is default
+    assert get_serializer(JSON, None, default) is default
+    assert get_serializer(None, None, default) is default
+    assert get_serializer(JSON) is SERIALIZERS[JSON]
+    octet = get_serializer('application/octet-stream', preferred, default)
+    assert isinstance(octet, BytesSerializer)
+    # unknown content type
+    assert get_serializer('text/plain', preferred, default) is preferred
+    assert get_serializer('text/plain', None, default) is default
+
+
+def test_function_serializer():
+    serializer = FunctionSerializer(lambda data: 'dumped', str.upper)
+    assert serializer.dumps({}) == b'dumped'
+    assert serializer.loads(b'body') == 'BODY'
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+
+import asyncpg
+import pytest
+from pydantic import BaseModel
+
+from fastapiplugins import controllers
+from fastapiplugins.controllers import insert_q, select_q, select_q_detailed
+
+from tests.fakes import FakeConnection, FakePool
+
+
+class Item(BaseModel):
+    id: int
+    title: str
+
+
+QUERY = 'SELECT * FROM items WHERE id = $1'
+
+
+@pytest.fixture
+def statements(database, monkeypatch):
+    monkeypatch.setattr(database.Config, 'STATEMENTS', {QUERY: None})
+    return database
+
+
+def test_get_statement_supported():
+    # private api checked by has_get_statement
+    assert controllers.has_get_statement()
+
+
+def test_prepared_after_init(statements, monkeypatch):
+    async def setup(conn):
+        # set_type_codec drops statement cache in asyncpg
+        await conn.set_type_codec('ltree', encoder=str, decoder=str)
+
+    monkeypatch.setattr(statements.Config, 'INIT', setup)
+    conn = FakeConnection()
+    asyncio.run(statements.init_connection(conn))
+    assert conn.log == [
+        'codec json', 'codec jsonb', 'codec ltree', 'prepare',
+    ]
+    assert conn.calls == [('prepare', QUERY, ())]
+
+
+def test_bad_statement_is_skipped(statements, caplog):
+    def fail(method, query, args):
+        raise asyncpg.UndefinedTableError('relation does not exist')
+
+    conn = FakeConnection(fail)
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(statements.init_connection(conn))
+    assert 'can not prepare statement' in caplog.text
+
+
+def test_lost_connection_is_raised(statements):
+    def fail(method, query, args):
+        raise ConnectionResetError
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(statements.init_connection(FakeConnection(fail)))
+
+
+def test_unsupported_asyncpg(statements, monkeypatch, caplog):
+    monkeypatch.setattr(controllers, 'has_get_statement', lambda: False)
+    conn = FakeConnection()
+    asyncio.run(statements.init_connection(conn))
+    assert conn.calls == []
+
+    async def create_pool(**kwargs):
+        return FakePool()
+
+    monkeypatch.setattr(asyncpg, 'create_pool', create_pool)
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(statements.start('db', 'user', 'password', 'localhost'))
+    assert statements.ready()
+    assert 'can not prepare statements in advance' in caplog.text
+
+
+def test_start(statements, monkeypatch):
+    pools = []
+
+    async def create_pool(**kwargs):
+        pools.append(kwargs)
+        if kwargs['host'] == 'down':
+            raise OSError('connection refused')
+        return FakePool()
+
+    monkeypatch.setattr(asyncpg, 'create_pool', create_pool)
+    asyncio.run(statements.start(
+        'db', 'user', 'password', 'primary',
+        replica_hosts='replica, down', min_size='2',
+    ))
+    assert statements.ready()
+    assert [pool['host'] for pool in pools] == ['primary', 'replica', 'down']
+    assert pools[0]['min_size'] == 2
+    assert pools[0]['init'] == statements.init_connection
+    primary = statements.Config.POOL
+    replica, = statements.Config.REPLICA_POOLS
+    asyncio.run(statements.stop())
+    assert not statements.ready()
+    assert primary.closed and replica.closed
+
+
+def test_register_model(database):
+    database.register_model('items', Item, lookups=['id'])
+    assert list(database.Config.STATEMENTS) == [
+        insert_q(Item(id=0, title=''), 'items')[0],
+        select_q_detailed('items', Item)[0],
+        select_q('items', id=0)[0],
+        select_q_detailed('items', Item, id=0)[0],
+    ]
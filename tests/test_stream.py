@@ -0,0 +1,68 @@
+import asyncio
+
+from pydantic import BaseModel
+
+from fastapiplugins.controllers import select_q
+
+from tests.fakes import FakeConnection, record
+
+
+class Item(BaseModel):
+    id: int
+    title: str
+
+
+ROWS = [record(id=i, title=f'item {i}') for i in range(3)]
+
+
+async def collect(stream) -> list:
+    return [row async for row in stream]
+
+
+def test_stream_records(database):
+    conn = database.Config.POOL.conn
+    conn.result = lambda method, query, args: ROWS
+    query = select_q('items', ordering=['id'], id=1)
+    rows = asyncio.run(collect(database.stream(*query, prefetch=2)))
+    assert rows == ROWS
+    assert conn.calls == [('cursor', query[0], (1,))]
+    assert conn.prefetch == 2
+    # server-side cursor lives in transaction
+    assert conn.log == ['begin', 'cursor', 'commit']
+    assert database.Config.POOL.in_use == 0
+
+
+def test_stream_models(database):
+    conn = FakeConnection(lambda method, query, args: ROWS)
+    stream = database.stream(
+        'SELECT * FROM items', model=Item, conn=conn,
+    )
+    assert asyncio.run(collect(stream)) == [
+        Item(id=i, title=f'item {i}') for i in range(3)
+    ]
+
+
+def test_stream_dicts(database):
+    conn = FakeConnection(lambda method, query, args: ROWS)
+    stream = database.stream(
+        'SELECT * FROM items', model=Item, mode='dict', conn=conn,
+    )
+    assert asyncio.run(collect(stream))[0] == {'id': 0, 'title': 'item 0'}
+    # connection of caller is not taken from pool
+    assert database.Config.POOL.acquired == 0
+
+
+def test_stream_break_releases_connection(database):
+    conn = database.Config.POOL.conn
+    conn.result = lambda method, query, args: ROWS
+
+    async def first():
+        stream = database.stream('SELECT * FROM items')
+        async for row in stream:
+            await stream.aclose()
+            return row
+
+    assert asyncio.run(first()) == ROWS[0]
+    # closed stream rolls back its read transaction
+    assert conn.log == ['begin', 'cursor', 'rollback']
+    assert database.Config.POOL.in_use == 0